@@ -0,0 +1,153 @@
+import numpy as np
+
+# Meters per degree of latitude, used to size the binning grid
+METERS_PER_DEGREE = 111320.0
+# Observations less precise than this are down-weighted in proportion, but
+# never below MIN_ACCURACY_WEIGHT
+ACCURACY_REFERENCE_METERS = 100.0
+MIN_ACCURACY_WEIGHT = 0.1
+
+
+# Function to convert observed_on strings to datetime64, with NaT for unknown
+# dates (NaT sorts last, like "Unknown" did when dates were compared as text)
+def parse_observed_dates(records):
+    return np.array(
+        [
+            record.observed_on if record.observed_on not in (None, "Unknown") else "NaT"
+            for record in records
+        ],
+        dtype="datetime64[D]",
+    )
+
+
+# Function to summarise a set of coordinates the way the maps need them
+def coordinate_summary(latitudes, longitudes, accuracies):
+    if len(latitudes):
+        map_center = [float(latitudes.mean()), float(longitudes.mean())]
+        bounds = [
+            [float(latitudes.min()), float(longitudes.min())],
+            [float(latitudes.max()), float(longitudes.max())],
+        ]
+    else:
+        map_center = [0, 0]
+        bounds = [[0, 0], [0, 0]]
+    return {
+        "latitudes": latitudes,
+        "longitudes": longitudes,
+        "accuracies": accuracies,
+        "count": len(latitudes),
+        "center": map_center,
+        "bounds": bounds,
+    }
+
+
+# Function to aggregate observation records per species in one vectorized pass.
+# All observations are held in contiguous NumPy columns sorted by species,
+# then date, then id (newest first among same-day records, matching the
+# stable sort the generators used to apply to the API feed order). Each
+# species is then a contiguous slice, so counts, centroids, bounding boxes
+# and first/latest observations all come from reductions over slice bounds.
+#
+# Returns the summary for all observations and a dict of per-species
+# summaries keyed by species name, in alphabetical order.
+def aggregate_species(records):
+    records = list(records)
+    if not records:
+        empty = np.empty(0, dtype=np.float64)
+        return coordinate_summary(empty, empty, empty), {}
+
+    latitudes = np.fromiter((r.latitude for r in records), np.float64, len(records))
+    longitudes = np.fromiter((r.longitude for r in records), np.float64, len(records))
+    accuracies = np.fromiter(
+        (
+            r.positional_accuracy if r.positional_accuracy is not None else np.nan
+            for r in records
+        ),
+        np.float64,
+        len(records),
+    )
+    ids = np.fromiter((r.id for r in records), np.int64, len(records))
+    dates = parse_observed_dates(records)
+    species_names, taxon_codes = np.unique(
+        [r.taxon_name for r in records], return_inverse=True
+    )
+
+    order = np.lexsort((-ids, dates, taxon_codes))
+    latitudes = latitudes[order]
+    longitudes = longitudes[order]
+    accuracies = accuracies[order]
+    taxon_codes = taxon_codes[order]
+
+    counts = np.bincount(taxon_codes, minlength=len(species_names))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ends = starts + counts
+    center_latitudes = np.add.reduceat(latitudes, starts) / counts
+    center_longitudes = np.add.reduceat(longitudes, starts) / counts
+    min_latitudes = np.minimum.reduceat(latitudes, starts)
+    min_longitudes = np.minimum.reduceat(longitudes, starts)
+    max_latitudes = np.maximum.reduceat(latitudes, starts)
+    max_longitudes = np.maximum.reduceat(longitudes, starts)
+
+    overall = coordinate_summary(latitudes, longitudes, accuracies)
+    species_data = {}
+    for code, species in enumerate(species_names.tolist()):
+        start, end = starts[code], ends[code]
+        first_observation = records[order[start]]
+        species_data[species] = {
+            "latitudes": latitudes[start:end],
+            "longitudes": longitudes[start:end],
+            "accuracies": accuracies[start:end],
+            "count": int(counts[code]),
+            "center": [float(center_latitudes[code]), float(center_longitudes[code])],
+            "bounds": [
+                [float(min_latitudes[code]), float(min_longitudes[code])],
+                [float(max_latitudes[code]), float(max_longitudes[code])],
+            ],
+            "first_observation": first_observation,
+            "recent_observation": records[order[end - 1]],
+            "taxon_id": first_observation.taxon_id,
+        }
+    return overall, species_data
+
+
+# Function to weight observations by their positional accuracy (in meters).
+# Unknown or better-than-reference accuracies keep a weight of 1.
+def accuracy_weights(accuracies):
+    weights = np.ones_like(accuracies)
+    imprecise = accuracies > ACCURACY_REFERENCE_METERS
+    weights[imprecise] = np.maximum(
+        ACCURACY_REFERENCE_METERS / accuracies[imprecise], MIN_ACCURACY_WEIGHT
+    )
+    return weights
+
+
+# Function to bin coordinates onto a square grid of roughly cell_meters,
+# returning one (latitude, longitude, weight) point per occupied cell. Each
+# cell sits at the weighted centroid of its points and carries their summed
+# weight, which is what leaflet-heat would accumulate for them anyway.
+# Cells are narrowed in longitude for the mean latitude of the points, or for
+# reference_latitude when given; sets binned with the same reference share
+# one grid, so binning their cells together again merges them exactly.
+def bin_coordinates(
+    latitudes, longitudes, cell_meters, weights=None, reference_latitude=None
+):
+    if weights is None:
+        weights = np.ones_like(latitudes)
+    if not len(latitudes):
+        return latitudes, longitudes, weights
+    if reference_latitude is None:
+        reference_latitude = latitudes.mean()
+
+    cell_latitude = cell_meters / METERS_PER_DEGREE
+    cell_longitude = cell_latitude / np.cos(np.radians(reference_latitude))
+    rows = np.floor(latitudes / cell_latitude).astype(np.int64)
+    columns = np.floor(longitudes / cell_longitude).astype(np.int64)
+    rows -= rows.min()
+    columns -= columns.min()
+    cell_keys = rows * (columns.max() + 1) + columns
+    _, cells = np.unique(cell_keys, return_inverse=True)
+
+    cell_weights = np.bincount(cells, weights)
+    cell_latitudes = np.bincount(cells, weights * latitudes) / cell_weights
+    cell_longitudes = np.bincount(cells, weights * longitudes) / cell_weights
+    return cell_latitudes, cell_longitudes, cell_weights
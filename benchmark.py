@@ -0,0 +1,313 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+
+from aggregation import aggregate_species
+from http_client import WIKIPEDIA_CLIENT
+from inat_sync import PER_PAGE, replay_observations
+from map_rendering import MapRenderer
+from instrumentation import peak_rss_mb
+from page_templates import species_options, write_paginated_pages
+from page_writer import PageWriter
+from stand_in_server import StandInHandler
+from wikipedia_descriptions import fetch_wikipedia_descriptions
+
+# Synthetic observations are scattered around the USP campus, the place the
+# generators are built for
+CAMPUS_CENTER = (-23.5614, -46.7300)
+CAMPUS_SPREAD_DEGREES = 0.01
+SPECIES_SPREAD_DEGREES = 0.002
+FIRST_OBSERVATION_DATE = date(2015, 1, 1)
+OBSERVATION_DAYS = 3650
+# Share of observations without photos, which the ingest has to drop
+NO_PHOTO_SHARE = 0.01
+DEFAULT_RESULTS_PATH = "benchmark_results.json"
+
+
+# Function to name a synthetic species
+def species_name(index):
+    return f"Synthetica{index // 10:04d} avis{index % 10}"
+
+
+# Function to write a synthetic observation feed shaped like the
+# /v1/observations API (the fields the generators read, plus the ones they
+# page on) as one captured page file per PER_PAGE records. Species sizes
+# follow a Zipf-like curve, as a few common birds make up most records.
+def synthesize_pages(directory, observation_count, species_count, seed=0):
+    rng = np.random.default_rng(seed)
+    popularity = 1 / np.arange(1, species_count + 1)
+    taxa = rng.choice(species_count, observation_count, p=popularity / popularity.sum())
+    centers = rng.normal(CAMPUS_CENTER, CAMPUS_SPREAD_DEGREES, (species_count, 2))
+    points = centers[taxa] + rng.normal(
+        0, SPECIES_SPREAD_DEGREES, (observation_count, 2)
+    )
+    days = rng.integers(0, OBSERVATION_DAYS, observation_count)
+    accuracies = rng.lognormal(3, 1.5, observation_count).round()
+    has_photo = rng.random(observation_count) >= NO_PHOTO_SHARE
+    users = rng.integers(0, max(observation_count // 20, 1), observation_count)
+    updated_at = datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat()
+
+    os.makedirs(directory, exist_ok=True)
+    # Newest ids first, like the feed the sync walks
+    for page_start in range(0, observation_count, PER_PAGE):
+        page = []
+        for i in range(page_start, min(page_start + PER_PAGE, observation_count)):
+            observation_id = observation_count - i
+            observed_on = (
+                FIRST_OBSERVATION_DATE + timedelta(days=int(days[i]))
+            ).isoformat()
+            page.append(
+                {
+                    "id": observation_id,
+                    "uuid": f"00000000-0000-0000-0000-{observation_id:012d}",
+                    "uri": f"https://www.inaturalist.org/observations/{observation_id}",
+                    "quality_grade": "research",
+                    "captive": False,
+                    "observed_on": observed_on,
+                    "created_at": updated_at,
+                    "updated_at": updated_at,
+                    "license_code": "cc-by",
+                    "positional_accuracy": int(accuracies[i]),
+                    "geojson": {
+                        "type": "Point",
+                        "coordinates": [float(points[i, 1]), float(points[i, 0])],
+                    },
+                    "location": f"{points[i, 0]},{points[i, 1]}",
+                    "photos": (
+                        [
+                            {
+                                "id": observation_id,
+                                "license_code": "cc-by",
+                                "url": f"https://static.inaturalist.org/photos/{observation_id}/square.jpg",
+                                "attribution": "(c) synthetic, some rights reserved (CC BY)",
+                            }
+                        ]
+                        if has_photo[i]
+                        else []
+                    ),
+                    "user": {"id": int(users[i]), "login": f"user{users[i]}"},
+                    "taxon": {
+                        "id": int(taxa[i]) + 1,
+                        "name": species_name(int(taxa[i])),
+                        "rank": "species",
+                        "iconic_taxon_name": "Aves",
+                    },
+                }
+            )
+        with open(
+            os.path.join(directory, f"page_{page_start // PER_PAGE:06d}.json"),
+            "w",
+            encoding="utf-8",
+        ) as f:
+            json.dump({"total_results": observation_count, "results": page}, f)
+
+
+# Function to serve Wikipedia fixtures for the synthetic species from a
+# stand-in server on a free local port, returning the server
+def start_wikipedia_stub(species_count):
+    StandInHandler.wikipedia_pages = {
+        species_name(index): f"<p>{species_name(index)} é uma ave sintética.</p>"
+        for index in range(species_count)
+    }
+    server = ThreadingHTTPServer(("localhost", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Function to write the paginated pages into the current directory, with the
+# same page loop paginated_heatmap_with_wikipedia runs
+def write_pages(
+    species_list, species_data, species_maps, species_descriptions, map_renderer
+):
+    page_writer = PageWriter("benchmark")
+    write_paginated_pages(
+        page_writer,
+        species_list,
+        species_data,
+        iter(species_maps),
+        species_options(species_list, species_data),
+        "",
+        species_descriptions=species_descriptions,
+    )
+    map_renderer.write_data(page_writer)
+    page_writer.finish()
+
+
+# Function to run the pipeline once at one scale inside a fresh process and
+# send back its measurements, so peak RSS belongs to this scale alone
+def run_scale(config, connection):
+    with tempfile.TemporaryDirectory(prefix="inat_heatmap_benchmark_") as directory:
+        os.chdir(directory)
+        synthesize_pages("pages", config["observations"], config["species"])
+        stages = {}
+        started_at = time.perf_counter()
+
+        stage_started_at = time.perf_counter()
+        observations = replay_observations("pages")
+        stages["ingest"] = time.perf_counter() - stage_started_at
+
+        stage_started_at = time.perf_counter()
+        all_observations, species_data = aggregate_species(observations)
+        stages["aggregate"] = time.perf_counter() - stage_started_at
+
+        server = start_wikipedia_stub(config["species"])
+        WIKIPEDIA_CLIENT.set_rate(0)
+        species_list = sorted(species_data)
+        stage_started_at = time.perf_counter()
+        species_descriptions = fetch_wikipedia_descriptions(
+            species_list,
+            "wikipedia_cache.json",
+            api_url=f"http://localhost:{server.server_address[1]}/w/api.php",
+        )
+        stages["wikipedia"] = time.perf_counter() - stage_started_at
+        server.shutdown()
+
+        map_renderer = MapRenderer(
+            config["render_mode"],
+            "heatmaps_data.json",
+            grid_cell_meters=config["grid_cell_meters"],
+            workers=config["workers"],
+        )
+        stage_started_at = time.perf_counter()
+        map_renderer.render("Complete_Heatmap", all_observations)
+        species_maps = list(
+            map_renderer.render_many(
+                (species.replace(" ", "_"), species_data[species])
+                for species in species_list
+            )
+        )
+        stages["render"] = time.perf_counter() - stage_started_at
+
+        stage_started_at = time.perf_counter()
+        write_pages(
+            species_list,
+            species_data,
+            species_maps,
+            species_descriptions,
+            map_renderer,
+        )
+        stages["write"] = time.perf_counter() - stage_started_at
+
+        wall_time = time.perf_counter() - started_at
+        output_bytes = sum(
+            os.path.getsize(name)
+            for name in os.listdir(".")
+            if name.startswith("heatmaps_")
+        )
+        os.chdir("/")
+    connection.send(
+        {
+            **config,
+            "records": len(observations),
+            "species_found": len(species_list),
+            "stages": {name: round(seconds, 4) for name, seconds in stages.items()},
+            "wall_time": round(wall_time, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "output_bytes": output_bytes,
+        }
+    )
+
+
+# Function to identify the code being measured
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Time each stage of the generation pipeline on synthetic observations "
+            "at several scales, without network access."
+        )
+    )
+    parser.add_argument(
+        "--observations",
+        type=int,
+        nargs="+",
+        default=[10000],
+        help="observation counts to benchmark (default: 10000)",
+    )
+    parser.add_argument(
+        "--species",
+        type=int,
+        nargs="+",
+        default=[50],
+        help="species counts to benchmark (default: 50)",
+    )
+    parser.add_argument("--render-mode", choices=["iframe", "data"], default="iframe")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--grid-cell-meters", type=float, default=0)
+    parser.add_argument(
+        "--output",
+        default=DEFAULT_RESULTS_PATH,
+        help=f"results file (default: {DEFAULT_RESULTS_PATH})",
+    )
+    args = parser.parse_args()
+
+    # Each scale runs in a forked process of its own
+    context = multiprocessing.get_context("fork")
+    runs = []
+    for observation_count in args.observations:
+        for species_count in args.species:
+            config = {
+                "observations": observation_count,
+                "species": species_count,
+                "render_mode": args.render_mode,
+                "workers": args.workers,
+                "grid_cell_meters": args.grid_cell_meters,
+            }
+            print(
+                f"Benchmarking {observation_count} observations, {species_count} species"
+            )
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=run_scale, args=(config, sender))
+            process.start()
+            sender.close()
+            try:
+                result = receiver.recv()
+            except EOFError:
+                print(f"  failed with exit code {process.join() or process.exitcode}")
+                continue
+            process.join()
+            runs.append(result)
+            print(
+                "  "
+                + ", ".join(
+                    f"{name} {seconds:.2f}s"
+                    for name, seconds in result["stages"].items()
+                )
+                + f"; wall {result['wall_time']:.2f}s, peak RSS {result['peak_rss_mb']} MB, "
+                f"{result['output_bytes'] / 1e6:.1f} MB written"
+            )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "revision": git_revision(),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "runs": runs,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Benchmark results saved as {args.output}")
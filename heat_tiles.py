@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+import zlib
+
+import numpy as np
+
+TILE_SIZE = 256
+DEFAULT_TILES_DIR = "heat_tiles"
+DEFAULT_MIN_ZOOM = 12
+DEFAULT_MAX_ZOOM = 17
+# Same look as the HeatMap layers: radius 30px plus leaflet-heat's default
+# 15px blur, in screen pixels at every zoom level
+HEAT_RADIUS = 30
+HEAT_BLUR = 15
+# leaflet-heat's default gradient
+GRADIENT = [
+    (0.4, (0, 0, 255)),
+    (0.6, (0, 255, 255)),
+    (0.7, (0, 255, 0)),
+    (0.8, (255, 255, 0)),
+    (1.0, (255, 0, 0)),
+]
+# Pixels whose intensity stays below this are left fully transparent
+MIN_INTENSITY = 0.01
+
+
+# Function to project coordinates to global Web Mercator pixel coordinates
+def mercator_pixels(latitudes, longitudes, zoom):
+    scale = TILE_SIZE * 2**zoom
+    sin_latitude = np.sin(np.radians(latitudes))
+    x = (longitudes + 180) / 360 * scale
+    y = (0.5 - np.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * np.pi)) * scale
+    return x, y
+
+
+# Function to build the point-spread kernel: a Gaussian that fades out at
+# radius + blur pixels, peaking at 1 in the centre like a single heat point
+def heat_kernel():
+    extent = HEAT_RADIUS + HEAT_BLUR
+    offsets = np.arange(-extent, extent + 1)
+    distance_squared = offsets[:, None] ** 2 + offsets[None, :] ** 2
+    sigma = extent / 3
+    kernel = np.exp(-distance_squared / (2 * sigma**2))
+    kernel[distance_squared > extent**2] = 0
+    return kernel
+
+
+# Function to convolve a density canvas with the kernel through the FFT
+def convolve(canvas, kernel):
+    shape = (
+        canvas.shape[0] + kernel.shape[0] - 1,
+        canvas.shape[1] + kernel.shape[1] - 1,
+    )
+    spectrum = np.fft.rfft2(canvas, shape) * np.fft.rfft2(kernel, shape)
+    full = np.fft.irfft2(spectrum, shape)
+    offset = kernel.shape[0] // 2
+    return full[offset : offset + canvas.shape[0], offset : offset + canvas.shape[1]]
+
+
+# Function to colour intensities in [0, 1] with the heat gradient, returning
+# an RGBA uint8 image whose alpha follows the intensity
+def colorize(intensity):
+    stops = [position for position, _ in GRADIENT]
+    rgba = np.zeros(intensity.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        values = [color[channel] for _, color in GRADIENT]
+        rgba[..., channel] = np.interp(intensity, stops, values).astype(np.uint8)
+    alpha = np.where(intensity >= MIN_INTENSITY, intensity, 0)
+    rgba[..., 3] = np.rint(alpha * 255).astype(np.uint8)
+    return rgba
+
+
+# Function to encode an RGBA uint8 image as PNG with the standard library
+def encode_png(rgba):
+    height, width, _ = rgba.shape
+
+    def chunk(kind, data):
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+        )
+
+    # Each scanline starts with filter type 0 (none)
+    scanlines = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rgba.reshape(height, width * 4)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 9))
+        + chunk(b"IEND", b"")
+    )
+
+
+# Function to render and write the tiles of one zoom level, returning how many
+# non-empty tiles were written
+def render_zoom_level(latitudes, longitudes, weights, zoom, output_dir, kernel):
+    x, y = mercator_pixels(latitudes, longitudes, zoom)
+    padding = kernel.shape[0] // 2
+    tile_x0 = int((x.min() - padding) // TILE_SIZE)
+    tile_y0 = int((y.min() - padding) // TILE_SIZE)
+    tile_x1 = int((x.max() + padding) // TILE_SIZE)
+    tile_y1 = int((y.max() + padding) // TILE_SIZE)
+    width = (tile_x1 - tile_x0 + 1) * TILE_SIZE
+    height = (tile_y1 - tile_y0 + 1) * TILE_SIZE
+
+    columns = (x - tile_x0 * TILE_SIZE).astype(np.int64)
+    rows = (y - tile_y0 * TILE_SIZE).astype(np.int64)
+    canvas = np.bincount(
+        rows * width + columns, weights, minlength=width * height
+    ).reshape(height, width)
+
+    # Overlapping points combine like stacked translucent circles, which
+    # 1 - exp(-density) approximates while keeping the result within [0, 1]
+    intensity = 1 - np.exp(-np.clip(convolve(canvas, kernel), 0, None))
+    image = colorize(intensity)
+
+    written = 0
+    for tile_row in range(tile_y1 - tile_y0 + 1):
+        for tile_column in range(tile_x1 - tile_x0 + 1):
+            tile = image[
+                tile_row * TILE_SIZE : (tile_row + 1) * TILE_SIZE,
+                tile_column * TILE_SIZE : (tile_column + 1) * TILE_SIZE,
+            ]
+            if not tile[..., 3].any():
+                continue
+            tile_dir = os.path.join(output_dir, str(zoom), str(tile_x0 + tile_column))
+            os.makedirs(tile_dir, exist_ok=True)
+            tile_path = os.path.join(tile_dir, f"{tile_y0 + tile_row}.png")
+            with open(tile_path, "wb") as f:
+                f.write(encode_png(tile))
+            written += 1
+    return written
+
+
+# Function to hash everything the tiles depend on, so an unchanged pyramid is
+# kept between builds
+def tiles_fingerprint(latitudes, longitudes, weights, min_zoom, max_zoom):
+    digest = hashlib.sha256()
+    for array in (latitudes, longitudes, weights):
+        digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    digest.update(
+        json.dumps([min_zoom, max_zoom, HEAT_RADIUS, HEAT_BLUR, GRADIENT]).encode()
+    )
+    return digest.hexdigest()
+
+
+# Function to pre-render a static z/x/y PNG heat tile pyramid for the given
+# points, returning the tile URL template for a Leaflet tile layer. The
+# density is computed once per zoom level on the server, so the browser only
+# has to display images however many observations there are.
+def build_heat_tiles(
+    latitudes,
+    longitudes,
+    weights=None,
+    output_dir=DEFAULT_TILES_DIR,
+    min_zoom=DEFAULT_MIN_ZOOM,
+    max_zoom=DEFAULT_MAX_ZOOM,
+):
+    tile_url = f"{output_dir}/{{z}}/{{x}}/{{y}}.png"
+    if weights is None:
+        weights = np.ones_like(latitudes)
+    fingerprint = tiles_fingerprint(latitudes, longitudes, weights, min_zoom, max_zoom)
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            if json.load(f).get("fingerprint") == fingerprint:
+                print(f"Heat tiles in {output_dir} are up to date")
+                return tile_url
+        shutil.rmtree(output_dir)
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = 0
+    if len(latitudes):
+        kernel = heat_kernel()
+        for zoom in range(min_zoom, max_zoom + 1):
+            written += render_zoom_level(
+                latitudes, longitudes, weights, zoom, output_dir, kernel
+            )
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"fingerprint": fingerprint, "min_zoom": min_zoom, "max_zoom": max_zoom},
+            f,
+        )
+    print(f"Heat tiles saved in {output_dir} ({written} tiles)")
+    return tile_url
@@ -0,0 +1,87 @@
+// Draws every species heatmap on a page from the shared map data file written
+// by the generators in "data" render mode. Each map is a placeholder
+// <div class="heatmap" data-map-id="..."> and its points are stored as
+// delta-encoded integer coordinates (see map_rendering.encode_coordinates).
+//
+// Maps are created only when their species-container scrolls near the
+// viewport and removed again once it is far away, so a page with hundreds of
+// species keeps just a few Leaflet maps alive at a time.
+(function () {
+    var script = document.currentScript;
+    var dataUrl = script.getAttribute("data-map-data");
+    // How close a container must get before its map is drawn, and how far it
+    // must move away before the map is torn down
+    var CREATE_MARGIN = "200px 0px";
+    var DESTROY_MARGIN = "3000px 0px";
+
+    function decodePoints(entry, scale) {
+        var points = [];
+        var encoded = entry.points;
+        var weights = entry.weights;
+        var lat = 0;
+        var lon = 0;
+        for (var i = 0; i < encoded.length; i += 2) {
+            lat += encoded[i];
+            lon += encoded[i + 1];
+            points.push([lat / scale, lon / scale, weights ? weights[i / 2] : 1]);
+        }
+        return points;
+    }
+
+    function drawMap(container, entry, data) {
+        var map = L.map(container, { center: entry.center, zoom: 10 });
+        L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {
+            maxZoom: 19,
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+        }).addTo(map);
+        if (entry.tiles) {
+            // Pre-rendered heat tile pyramid (see heat_tiles.py)
+            L.tileLayer(entry.tiles, { maxNativeZoom: entry.maxNativeZoom }).addTo(map);
+        } else {
+            // Same options as the iframe maps (map_rendering.HEAT_LAYER_OPTIONS)
+            L.heatLayer(decodePoints(entry, data.scale), data.heatOptions).addTo(map);
+        }
+        map.fitBounds(entry.bounds);
+        return map;
+    }
+
+    function observeMaps(data) {
+        var containers = document.querySelectorAll(".heatmap[data-map-id]");
+        var mapsBySection = new Map();
+
+        var creator = new IntersectionObserver(function (entries) {
+            entries.forEach(function (observed) {
+                var container = mapsBySection.get(observed.target);
+                if (!observed.isIntersecting || container.leafletMap) {
+                    return;
+                }
+                var entry = data.maps[container.getAttribute("data-map-id")];
+                if (entry) {
+                    container.leafletMap = drawMap(container, entry, data);
+                }
+            });
+        }, { rootMargin: CREATE_MARGIN });
+
+        var destroyer = new IntersectionObserver(function (entries) {
+            entries.forEach(function (observed) {
+                var container = mapsBySection.get(observed.target);
+                if (observed.isIntersecting || !container.leafletMap) {
+                    return;
+                }
+                container.leafletMap.remove();
+                container.leafletMap = null;
+            });
+        }, { rootMargin: DESTROY_MARGIN });
+
+        containers.forEach(function (container) {
+            var section = container.closest(".species-container") || container;
+            mapsBySection.set(section, container);
+            creator.observe(section);
+            destroyer.observe(section);
+        });
+    }
+
+    fetch(dataUrl)
+        .then(function (response) { return response.json(); })
+        .then(observeMaps);
+})();
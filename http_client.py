@@ -0,0 +1,137 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = "inat_heatmap (https://github.com/lubianat/inat_heatmap)"
+DEFAULT_TIMEOUT = 30
+# Responses worth retrying: rate limiting and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+
+# Token bucket shared by every thread using a client: up to burst requests
+# may go out at once, after which requests are spaced to rate per second
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Function to wait until a request may be sent
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0
+            # Take the token now, so concurrent callers queue up behind it
+            self.tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+
+
+# HTTP client for one API: a keep-alive connection pool, a rate limit, retries
+# with exponential backoff on 429/5xx responses and connection errors, and
+# latency metrics for every request. Responses are returned whatever their
+# status once retries run out, so callers keep handling errors themselves.
+class HttpClient:
+    def __init__(self, name, rate, burst, pool_size=10, timeout=DEFAULT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.rate_limiter = None
+        self.set_rate(rate, burst)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.bytes_received = 0
+        self.retries = 0
+
+    # Function to change the rate limit; a rate of 0 disables it, e.g. for a
+    # local stand-in server
+    def set_rate(self, rate, burst=None):
+        if burst is None:
+            burst = self.rate_limiter.burst if self.rate_limiter else 1
+        self.rate_limiter = TokenBucket(rate, burst) if rate > 0 else None
+
+    # Function to send a GET request through the pool and the rate limit
+    def get(self, url, params=None, headers=None):
+        for attempt in range(MAX_RETRIES + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            started_at = time.perf_counter()
+            try:
+                response = self.session.get(
+                    url, params=params, headers=headers, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == MAX_RETRIES:
+                    raise
+                self.back_off(attempt, None)
+                continue
+            self.record(time.perf_counter() - started_at, len(response.content))
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                return response
+            self.back_off(attempt, response.headers.get("Retry-After"))
+
+    # Function to sleep before a retry, honouring Retry-After when the server
+    # sends it in seconds
+    def back_off(self, attempt, retry_after):
+        with self.lock:
+            self.retries += 1
+        delay = min(BACKOFF_SECONDS * 2**attempt, MAX_BACKOFF_SECONDS)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        time.sleep(delay)
+
+    # Function to record one completed request
+    def record(self, latency, size):
+        with self.lock:
+            self.latencies.append(latency)
+            self.bytes_received += size
+
+    # Function to summarise the requests made so far
+    def metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                "requests": len(latencies),
+                "retries": self.retries,
+                "bytes": self.bytes_received,
+                "latency_mean": sum(latencies) / len(latencies) if latencies else 0,
+                "latency_p95": (
+                    latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0
+                ),
+                "latency_max": latencies[-1] if latencies else 0,
+            }
+
+    # Function to print the metrics in one line
+    def print_metrics(self):
+        metrics = self.metrics()
+        if not metrics["requests"]:
+            return
+        print(
+            f"{self.name}: {metrics['requests']} requests, "
+            f"{metrics['retries']} retries, {metrics['bytes'] / 1e6:.1f} MB, "
+            f"latency mean {metrics['latency_mean'] * 1000:.0f} ms, "
+            f"p95 {metrics['latency_p95'] * 1000:.0f} ms, "
+            f"max {metrics['latency_max'] * 1000:.0f} ms"
+        )
+
+
+# Shared clients. iNaturalist asks API users to stay around one request per
+# second; Wikipedia only asks for a descriptive User-Agent and serial use.
+INAT_REQUESTS_PER_SECOND = 1.0
+INAT_CLIENT = HttpClient("iNaturalist API", rate=INAT_REQUESTS_PER_SECOND, burst=5)
+WIKIPEDIA_CLIENT = HttpClient("Wikipedia API", rate=10.0, burst=10)
@@ -0,0 +1,645 @@
+import json
+import os
+import queue
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from http_client import INAT_CLIENT, INAT_REQUESTS_PER_SECOND
+from observation_dataset import load_manifest, read_dataset, write_dataset
+from observation_records import ObservationRecord
+from sync_checkpoint import SyncCheckpoint
+
+INAT_OBSERVATIONS_URL = "https://api.inaturalist.org/v1/observations"
+OBSERVATION_FILTERS = (
+    "place_id=125852&iconic_taxa=Aves&quality_grade=research&captive=false"
+)
+PER_PAGE = 200
+DEFAULT_STORE_PATH = "observation_store"
+
+
+# Pages fetched ahead of the one being merged, per concurrent source
+PREFETCH_PAGES = 2
+
+# Records edited around the moment of the previous sync could be missed if the
+# local and server clocks disagree, so each incremental sync overlaps a little
+UPDATED_SINCE_OVERLAP = timedelta(minutes=10)
+
+# Deletions, and records that stopped matching the filters (e.g. downgraded
+# below research grade), never show up in the updated_since feed, so every
+# so often an incremental sync also walks the ids of the whole feed
+DEFAULT_RECONCILE_DAYS = 7
+# A reconciliation is only applied when its id walk saw at least this share
+# of the observations the feed reports; a shorter (or empty) walk was
+# truncated, and would drop records that are still in the feed
+RECONCILE_MIN_WALKED_SHARE = 0.99
+# As a second check, a reconciliation that would drop more than this share of
+# the store (and more than RECONCILE_MIN_ALLOWED records, so a few real
+# deletions from a small store still go through) is not applied either
+RECONCILE_MAX_REMOVED_SHARE = 0.1
+RECONCILE_MIN_ALLOWED = 20
+
+
+class FetchError(Exception):
+    pass
+
+
+class IncompleteSyncError(FetchError):
+    pass
+
+
+# Function to register the sync options shared by all generators
+def add_sync_arguments(parser):
+    parser.add_argument(
+        "--store",
+        default=DEFAULT_STORE_PATH,
+        help=f"local observation store (default: {DEFAULT_STORE_PATH})",
+    )
+    parser.add_argument(
+        "--full-sync",
+        action="store_true",
+        help="ignore the local store and download the whole observation feed",
+    )
+    parser.add_argument(
+        "--skip-sync",
+        action="store_true",
+        help="build from the local store as it is, without contacting the API",
+    )
+    parser.add_argument(
+        "--inat-api",
+        default=INAT_OBSERVATIONS_URL,
+        help=f"observations endpoint to sync from (default: {INAT_OBSERVATIONS_URL})",
+    )
+    parser.add_argument(
+        "--requests-per-second",
+        type=float,
+        default=INAT_REQUESTS_PER_SECOND,
+        help=(
+            "rate limit for the observations endpoint "
+            f"(default: {INAT_REQUESTS_PER_SECOND}; 0 disables it)"
+        ),
+    )
+    parser.add_argument(
+        "--input",
+        help=(
+            "build from captured API responses instead of syncing: a JSON file "
+            "with a list of observations or a page of results, or a directory "
+            "of such files"
+        ),
+    )
+    parser.add_argument(
+        "--fetch-workers",
+        type=int,
+        default=1,
+        help=(
+            "page through disjoint id windows of the feed concurrently during a "
+            "full sync (default: 1, sequential)"
+        ),
+    )
+    parser.add_argument(
+        "--allow-incomplete",
+        action="store_true",
+        help=(
+            "build from the records fetched so far when the sync fails, or "
+            "from no species at all, instead of stopping before any page is "
+            "written"
+        ),
+    )
+    parser.add_argument(
+        "--reconcile-days",
+        type=float,
+        default=DEFAULT_RECONCILE_DAYS,
+        help=(
+            "days between id-only walks of the feed that drop deleted records "
+            f"from the store (default: {DEFAULT_RECONCILE_DAYS}; 0 reconciles "
+            "on every run)"
+        ),
+    )
+    parser.add_argument(
+        "--spill-dir",
+        help=(
+            "stream a full walk of the feed (or the --input pages) into "
+            "per-species files in this directory instead of holding every "
+            "record in memory; the local store is left untouched. The "
+            "complete heatmap of heatmap_generator.py still holds every point "
+            "unless --grid-cell-meters bins them"
+        ),
+    )
+
+
+# Function to create an empty observation store
+def empty_store():
+    return {
+        "last_synced_at": None,
+        "last_reconciled_at": None,
+        "max_id": 0,
+        "observations": {},
+    }
+
+
+# Function to load the local observation store, or an empty one
+def load_store(path):
+    dataset = read_dataset(path)
+    if dataset is None:
+        return empty_store()
+    records, state = dataset
+    return {
+        "last_synced_at": state["last_synced_at"],
+        "last_reconciled_at": state.get("last_reconciled_at"),
+        "max_id": state["max_id"],
+        "observations": {record.id: record for record in records},
+    }
+
+
+# Function to save the store as a columnar dataset; the new version only
+# replaces the old one once it is completely written
+def save_store(store, path):
+    write_dataset(
+        path,
+        sorted_observations(store),
+        {
+            "last_synced_at": store["last_synced_at"],
+            "last_reconciled_at": store["last_reconciled_at"],
+            "max_id": store["max_id"],
+        },
+    )
+
+
+# Function to list stored records newest first, like the API feed
+def sorted_observations(store):
+    return [
+        store["observations"][observation_id]
+        for observation_id in sorted(store["observations"], reverse=True)
+    ]
+
+
+# Function to walk the observation feed, yielding one page of results at a time.
+# Pages are keyed on the observation id so the cursor survives new uploads:
+# descending walks use id_below, ascending walks use id_above. Requests go
+# through the shared client, which retries 429/5xx responses with backoff,
+# so a FetchError means the page could not be fetched at all.
+def fetch_observation_pages(
+    extra_params="", ascending=False, cursor=None, api_url=INAT_OBSERVATIONS_URL
+):
+    order = "asc" if ascending else "desc"
+    cursor_param = "id_above" if ascending else "id_below"
+    base_url = (
+        f"{api_url}?{OBSERVATION_FILTERS}"
+        f"&order={order}&order_by=id&per_page={PER_PAGE}{extra_params}"
+    )
+    url = base_url if cursor is None else f"{base_url}&{cursor_param}={cursor}"
+    while True:
+        response = INAT_CLIENT.get(url)
+        if response.status_code != 200:
+            raise FetchError(f"HTTP {response.status_code} for {url}")
+        observations = response.json()["results"]
+        if observations:
+            yield observations
+        # Check if there are more results
+        if len(observations) < PER_PAGE:
+            return
+        url = f"{base_url}&{cursor_param}={observations[-1]['id']}"
+
+
+# Function to get the number of observations in the feed and its lowest and
+# highest ids, from two one-result requests
+def probe_feed(api_url=INAT_OBSERVATIONS_URL):
+    bounds = []
+    for order in ("asc", "desc"):
+        url = (
+            f"{api_url}?{OBSERVATION_FILTERS}" f"&order={order}&order_by=id&per_page=1"
+        )
+        response = INAT_CLIENT.get(url)
+        if response.status_code != 200:
+            raise FetchError(f"HTTP {response.status_code} for {url}")
+        data = response.json()
+        if not data["results"]:
+            return 0, 0, 0
+        bounds.append(data["results"][0]["id"])
+    return data["total_results"], bounds[0], bounds[1]
+
+
+# Function to run page sources on background threads and yield their pages
+# through a queue of at most depth pages. The next request is already in
+# flight (and its JSON parsed) while the caller merges the current page, and
+# a slow consumer blocks the producers instead of letting pages pile up.
+# Pages from several sources arrive interleaved; an error in any source is
+# re-raised here, and the other sources stop at their next page.
+def pipelined(sources, depth=PREFETCH_PAGES):
+    pages = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(message):
+        while not stopped.is_set():
+            try:
+                pages.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(source):
+        try:
+            for page in source:
+                if not put((page, None)):
+                    return
+            put((None, None))
+        except BaseException as e:
+            put((None, e))
+
+    producers = [
+        threading.Thread(target=produce, args=(source,), daemon=True)
+        for source in sources
+    ]
+    for producer in producers:
+        producer.start()
+    remaining = len(producers)
+    try:
+        while remaining:
+            page, error = pages.get()
+            if error is not None:
+                raise error
+            if page is None:
+                remaining -= 1
+            else:
+                yield page
+    finally:
+        stopped.set()
+
+
+# Function to describe a resumable walk of the feed: the arguments of
+# fetch_observation_pages, as plain values so the walk can be checkpointed,
+# with the cursor moved past every page the caller accepts
+def feed_walk(ascending=False, cursor=None, id_above=None, updated_since=None):
+    return {
+        "ascending": ascending,
+        "cursor": cursor,
+        "id_above": id_above,
+        "updated_since": updated_since,
+    }
+
+
+# Function to page through a walk from its cursor
+def walk_pages(walk, api_url=INAT_OBSERVATIONS_URL):
+    extra_params = ""
+    if walk["id_above"] is not None:
+        extra_params += f"&id_above={walk['id_above']}"
+    if walk["updated_since"]:
+        extra_params += "&updated_since=" + requests.utils.quote(walk["updated_since"])
+    return fetch_observation_pages(
+        extra_params,
+        ascending=walk["ascending"],
+        cursor=walk["cursor"],
+        api_url=api_url,
+    )
+
+
+# Function to tag the pages of a walk with its index among concurrent walks
+def tagged_pages(index, pages):
+    for page in pages:
+        yield index, page
+
+
+# Function to plan the walks of a full download. With several workers, the id
+# range reported by probe_feed is cut into disjoint windows, each paged
+# through with its own id_below cursor, so the windows do not depend on each
+# other and their round trips overlap. Every request still goes through the
+# shared client, so the global rate limit holds.
+def full_walks(fetch_workers=1, api_url=INAT_OBSERVATIONS_URL):
+    if fetch_workers <= 1:
+        return [feed_walk()]
+    total_results, min_id, max_id = probe_feed(api_url)
+    if not total_results:
+        return []
+    pages = -(-total_results // PER_PAGE)
+    # Every window ends on a short page, so more windows than workers would
+    # only add requests under the shared rate limit
+    shards = max(1, min(pages, fetch_workers))
+    span = max_id - min_id + 1
+    edges = [min_id - 1 + span * shard // shards for shard in range(shards + 1)]
+    return [
+        feed_walk(cursor=edges[shard + 1] + 1, id_above=edges[shard])
+        for shard in range(shards)
+    ]
+
+
+# Function to walk the whole feed, sharded across concurrent id windows when
+# fetch_workers > 1, yielding pages as they arrive
+def full_walk_pages(fetch_workers=1, api_url=INAT_OBSERVATIONS_URL):
+    walks = full_walks(fetch_workers, api_url)
+    return pipelined(
+        [walk_pages(walk, api_url) for walk in walks],
+        depth=PREFETCH_PAGES * max(1, len(walks)),
+    )
+
+
+# Function to tell whether a fetched copy of a record is older than the
+# stored one; records without an updated_at are never treated as stale
+def is_stale(updated_at, stored_updated_at):
+    if not updated_at or not stored_updated_at:
+        return False
+    return datetime.fromisoformat(
+        updated_at.replace("Z", "+00:00")
+    ) < datetime.fromisoformat(stored_updated_at.replace("Z", "+00:00"))
+
+
+# Function to project a page of raw API observations to (id, updated_at,
+# record) entries, with record None for observations that cannot be mapped
+# (e.g. their photo was removed). The raw API dicts never outlive the page
+# they came in.
+def page_entries(observations):
+    return [
+        (
+            observation["id"],
+            observation.get("updated_at"),
+            ObservationRecord.from_api(observation),
+        )
+        for observation in observations
+    ]
+
+
+# Function to upsert page entries into the store by id, returning a Counter
+# of records added, updated (and of those, moved to another species),
+# removed and skipped as stale. A fetched record only replaces the stored
+# one if its updated_at is not older, so merging a page twice, or pages from
+# overlapping windows in any order, leaves the same store.
+def merge_entries(store, entries):
+    changes = Counter()
+    for observation_id, updated_at, record in entries:
+        store["max_id"] = max(store["max_id"], observation_id)
+        stored = store["observations"].get(observation_id)
+        if stored is not None and is_stale(updated_at, stored.updated_at):
+            changes["stale"] += 1
+            continue
+        if record is None:
+            # No longer mappable
+            if store["observations"].pop(observation_id, None) is not None:
+                changes["removed"] += 1
+            continue
+        if stored is None:
+            changes["added"] += 1
+        elif record.to_list() != stored.to_list():
+            changes["updated"] += 1
+            if record.taxon_name != stored.taxon_name:
+                changes["moved"] += 1
+        store["observations"][observation_id] = record
+    return changes
+
+
+# Function to upsert fetched pages into the store, returning the changes
+def merge_pages(store, pages):
+    changes = Counter()
+    for observations in pages:
+        changes.update(merge_entries(store, page_entries(observations)))
+    return changes
+
+
+# Function to drop stored records that are no longer in the feed, from a walk
+# that asks only for ids, returning how many were dropped, or None when the
+# removal looked implausible and was refused
+def reconcile_store(store, api_url=INAT_OBSERVATIONS_URL):
+    total_results, _, _ = probe_feed(api_url)
+    feed_ids = set()
+    id_pages = fetch_observation_pages("&only_id=true", api_url=api_url)
+    for observations in pipelined([id_pages]):
+        feed_ids.update(observation["id"] for observation in observations)
+    if not feed_ids or len(feed_ids) < RECONCILE_MIN_WALKED_SHARE * total_results:
+        print(
+            f"Reconciliation walk saw {len(feed_ids)} of the {total_results} "
+            "observations in the feed; keeping the stored observations"
+        )
+        return None
+    gone = [
+        observation_id
+        for observation_id in store["observations"]
+        if observation_id not in feed_ids
+    ]
+    if len(gone) > max(
+        RECONCILE_MAX_REMOVED_SHARE * len(store["observations"]),
+        RECONCILE_MIN_ALLOWED,
+    ):
+        print(
+            f"Reconciliation would remove {len(gone)} of "
+            f"{len(store['observations'])} stored observations; keeping them "
+            "(run with --full-sync if the feed really shrank)"
+        )
+        return None
+    for observation_id in gone:
+        del store["observations"][observation_id]
+    return len(gone)
+
+
+# Function to bring the local store up to date and return all records.
+# A first run (or one on a store that was never synced) downloads the whole
+# feed; later runs only ask for observations uploaded after the newest stored
+# id and for older ones updated since the previous sync, and every
+# reconcile_days also walk the ids of the feed to drop deleted records.
+# With fetch_workers > 1, a full download is sharded across concurrent id
+# windows; merging by id keeps the result the same.
+#
+# Every accepted page is checkpointed next to the store, and a sync that
+# fails resumes from the checkpoint on the next run instead of starting over
+# (unless a full sync is asked for while an incremental one is pending).
+# A failed sync raises IncompleteSyncError, unless allow_incomplete is set,
+# in which case the records fetched so far are returned; the store itself
+# is only saved once a sync completes.
+def sync_observations(
+    store_path=DEFAULT_STORE_PATH,
+    full=False,
+    fetch_workers=1,
+    api_url=INAT_OBSERVATIONS_URL,
+    reconcile_days=DEFAULT_RECONCILE_DAYS,
+    allow_incomplete=False,
+):
+    store = load_store(store_path)
+    checkpoint = SyncCheckpoint(f"{store_path}.checkpoint")
+    changes = Counter()
+
+    try:
+        if checkpoint.load() and (not full or checkpoint.state["mode"] == "full"):
+            print(
+                f"Resuming the {checkpoint.state['mode']} sync started at "
+                f"{checkpoint.state['started_at']} from "
+                f"{checkpoint.state['pages']} checkpointed pages"
+            )
+        else:
+            started_at = datetime.now(timezone.utc).isoformat()
+            # A store that was never synced (e.g. imported from captured
+            # pages) has no updated_since window to start from
+            if full or not store["observations"] or not store["last_synced_at"]:
+                stages = [full_walks(fetch_workers, api_url)]
+                checkpoint.start("full", started_at, stages)
+            else:
+                updated_since = (
+                    datetime.fromisoformat(store["last_synced_at"])
+                    - UPDATED_SINCE_OVERLAP
+                )
+                stages = [
+                    [feed_walk(ascending=True, cursor=store["max_id"])],
+                    [feed_walk(updated_since=updated_since.isoformat())],
+                ]
+                checkpoint.start("incremental", started_at, stages)
+
+        if checkpoint.state["mode"] == "full":
+            store = empty_store()
+        for entries in checkpoint.saved_pages():
+            changes.update(merge_entries(store, entries))
+        stages = checkpoint.state["stages"]
+        while checkpoint.state["stage"] < len(stages):
+            walks = stages[checkpoint.state["stage"]]
+            pages = pipelined(
+                [
+                    tagged_pages(index, walk_pages(walk, api_url))
+                    for index, walk in enumerate(walks)
+                ],
+                depth=PREFETCH_PAGES * max(1, len(walks)),
+            )
+            for index, observations in pages:
+                entries = page_entries(observations)
+                changes.update(merge_entries(store, entries))
+                walks[index]["cursor"] = observations[-1]["id"]
+                checkpoint.accept(entries)
+            checkpoint.finish_stage()
+
+        sync_started_at = datetime.fromisoformat(checkpoint.state["started_at"])
+        if checkpoint.state["mode"] == "full":
+            # A full walk sees exactly what is in the feed
+            store["last_reconciled_at"] = sync_started_at.isoformat()
+            print(f"Full sync: {changes['added']} observations downloaded")
+        else:
+            if store["last_reconciled_at"] is None or sync_started_at - (
+                datetime.fromisoformat(store["last_reconciled_at"])
+            ) >= timedelta(days=reconcile_days):
+                removed = reconcile_store(store, api_url)
+                if removed is not None:
+                    # A refused pass is tried again on the next sync
+                    changes["removed"] += removed
+                    store["last_reconciled_at"] = sync_started_at.isoformat()
+            print(
+                f"Incremental sync: {changes['added']} new observations, "
+                f"{changes['updated']} updated ({changes['moved']} moved to "
+                f"another species), {changes['removed']} removed, "
+                f"{len(store['observations'])} stored"
+            )
+    except (FetchError, requests.RequestException) as e:
+        # Keep the previous store on disk; the checkpoint holds the progress
+        print(f"Failed to fetch data: {e}")
+        INAT_CLIENT.print_metrics()
+        if checkpoint.state:
+            print(
+                f"{checkpoint.state['pages']} pages are checkpointed in "
+                f"{checkpoint.directory}; the next sync resumes from there"
+            )
+        if not allow_incomplete:
+            raise IncompleteSyncError(f"Sync incomplete: {e}") from e
+        return sorted_observations(store)
+
+    INAT_CLIENT.print_metrics()
+    store["last_synced_at"] = checkpoint.state["started_at"]
+    save_store(store, store_path)
+    checkpoint.clear()
+    return sorted_observations(store)
+
+
+# Function to yield the pages captured in a file or directory of files. Each
+# file holds either a list of observations or a whole API response.
+def read_captured_pages(path):
+    if os.path.isdir(path):
+        paths = [
+            os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if name.endswith(".json")
+        ]
+    else:
+        paths = [path]
+    for page_path in paths:
+        with open(page_path, encoding="utf-8") as f:
+            data = json.load(f)
+        yield data["results"] if isinstance(data, dict) else data
+
+
+# Function to load records from captured API responses, without touching the
+# network or the local store, so a build can be replayed exactly
+def replay_observations(path):
+    store = empty_store()
+    merge_pages(store, read_captured_pages(path))
+    print(f"Replayed {len(store['observations'])} observations from {path}")
+    return sorted_observations(store)
+
+
+# Function to get the records a generator should build from: replayed from
+# --input when given, read from the local store with --skip-sync, otherwise
+# synced with the observations endpoint
+def observations_from_args(args):
+    if args.input:
+        return replay_observations(args.input)
+    if args.skip_sync:
+        if load_manifest(args.store) is None:
+            sys.exit(f"No observation store at {args.store} to build from")
+        store = load_store(args.store)
+        print(f"Loaded {len(store['observations'])} observations from {args.store}")
+        return sorted_observations(store)
+    INAT_CLIENT.set_rate(args.requests_per_second)
+    try:
+        return sync_observations(
+            args.store,
+            full=args.full_sync,
+            fetch_workers=args.fetch_workers,
+            api_url=args.inat_api,
+            reconcile_days=args.reconcile_days,
+            allow_incomplete=args.allow_incomplete,
+        )
+    except IncompleteSyncError as e:
+        refuse_partial_build(e, "rerun to resume the sync")
+
+
+# Function to stop a build whose fetch failed, before any page is written
+def refuse_partial_build(error, retry_hint):
+    sys.exit(
+        f"{error}. Not building from partial data: {retry_hint}, "
+        "or pass --allow-incomplete to build anyway."
+    )
+
+
+# Function to stop a build that found no species, before its empty pages
+# replace the published ones; an empty feed page or input is far more likely
+# than a site that really has no birds any more
+def refuse_empty_build(species_data, args):
+    if not species_data and not args.allow_incomplete:
+        sys.exit(
+            "No species found in the observations. Not replacing the published "
+            "pages: check the sync or the input, or pass --allow-incomplete to "
+            "build anyway."
+        )
+
+
+# Function to get the raw pages a streaming build should spill: the captured
+# pages from --input when given, otherwise a full walk of the observations
+# endpoint. The local store is neither read nor updated.
+def observation_pages_from_args(args):
+    if args.skip_sync:
+        sys.exit(
+            "--skip-sync cannot be combined with --spill-dir: a streaming build "
+            "walks the whole feed (use --input to stream captured pages)"
+        )
+    if args.input:
+        return read_captured_pages(args.input)
+    INAT_CLIENT.set_rate(args.requests_per_second)
+    return checked_full_walk_pages(args)
+
+
+# Function to walk the whole feed for a streaming build. The walk is not
+# checkpointed, so a failed page stops the build (or, with
+# --allow-incomplete, ends the walk with the pages fetched so far).
+def checked_full_walk_pages(args):
+    try:
+        yield from full_walk_pages(args.fetch_workers, args.inat_api)
+    except (FetchError, requests.RequestException) as e:
+        print(f"Failed to fetch data: {e}")
+        if not args.allow_incomplete:
+            refuse_partial_build(e, "rerun the build")
+    finally:
+        INAT_CLIENT.print_metrics()
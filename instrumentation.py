@@ -0,0 +1,142 @@
+import cProfile
+import json
+import platform
+import resource
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from http_client import INAT_CLIENT, WIKIPEDIA_CLIENT
+
+DEFAULT_REPORT_PATH = "run_report.json"
+
+
+# Function to register the instrumentation options shared by all generators
+def add_report_arguments(parser):
+    parser.add_argument(
+        "--report",
+        default=DEFAULT_REPORT_PATH,
+        help=(
+            "JSON run report with stage timings, requests, peak memory and "
+            f"per-species render times (default: {DEFAULT_REPORT_PATH}; "
+            "'none' disables it)"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="write a cProfile dump of the whole run, readable with pstats",
+    )
+
+
+# Function to get the peak resident memory of this process in MB
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    divisor = 1024**2 if platform.system() == "Darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1)
+
+
+# Collects timings for one generator run. Stages nest, and each stage is
+# charged only for the time not spent in the stages nested inside it, so
+# e.g. maps rendered lazily while pages are written count as "render" and
+# not also as "write". The stage times therefore add up to the run time.
+class RunReport:
+    def __init__(self, path=DEFAULT_REPORT_PATH, profile_path=None):
+        self.path = path
+        self.profile_path = profile_path
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.stack = []
+        self.charged_at = self.start
+        self.profiler = None
+        if profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            None if args.report == "none" else args.report, profile_path=args.profile
+        )
+
+    # Function to charge the time since the last switch to the running stage
+    def charge(self):
+        now = time.perf_counter()
+        if self.stack:
+            self.stages[self.stack[-1]] += now - self.charged_at
+        self.charged_at = now
+
+    # Function to start the next top-level stage, ending the previous one
+    def begin(self, name):
+        self.charge()
+        self.stack = [name]
+
+    # Function to time a block as the given stage
+    @contextmanager
+    def stage(self, name):
+        self.charge()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.charge()
+            self.stack.pop()
+
+    # Function to time every step of an iterator as the given stage, for
+    # generators whose work happens as they are consumed
+    def timed(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    # Function to stop profiling, print the stage summary and write the report
+    def finish(self, render_times=None):
+        self.charge()
+        self.stack = []
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            print(f"Profile saved as {self.profile_path}")
+        wall_time = time.perf_counter() - self.start
+        print(
+            "Stages: "
+            + ", ".join(
+                f"{name} {seconds:.2f}s" for name, seconds in self.stages.items()
+            )
+            + f"; total {wall_time:.2f}s, peak memory {peak_rss_mb()} MB"
+        )
+        if not self.path:
+            return
+        render_times = render_times or {}
+        report = {
+            "argv": sys.argv,
+            "started_at": self.started_at.isoformat(),
+            "wall_time": round(wall_time, 4),
+            "stages": {
+                name: round(seconds, 4) for name, seconds in self.stages.items()
+            },
+            "peak_rss_mb": peak_rss_mb(),
+            "http": {
+                client.name: client.metrics()
+                for client in (INAT_CLIENT, WIKIPEDIA_CLIENT)
+                if client.metrics()["requests"]
+            },
+            # Slowest first; maps reused from the render cache are not listed
+            "render_seconds": {
+                map_id: round(seconds, 4)
+                for map_id, seconds in sorted(
+                    render_times.items(), key=lambda item: item[1], reverse=True
+                )
+            },
+        }
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Run report saved as {self.path}")
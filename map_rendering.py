@@ -0,0 +1,395 @@
+import json
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import folium
+import numpy as np
+from branca.element import Figure
+from folium.plugins import HeatMap
+
+from aggregation import accuracy_weights, bin_coordinates
+from render_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_MB, RenderCache
+
+# Options of every heat layer, in leaflet-heat's names. Iframe maps pass them
+# to folium's HeatMap and the data file hands them to heatmaps.js, so both
+# render modes draw the same heatmap.
+HEAT_LAYER_OPTIONS = {"minOpacity": 0.5, "maxZoom": 18, "radius": 30, "blur": 15}
+
+
+# HeatMap layer fed straight from coordinate arrays. folium's HeatMap
+# validates every point in a Python loop; here the columns are stacked and
+# checked once with NumPy, so no DataFrame or per-point validation is needed.
+class CoordinateHeatMap(HeatMap):
+    def __init__(self, latitudes, longitudes, weights=None, **kwargs):
+        super().__init__([], **kwargs)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if weights is None:
+            weights = np.ones_like(latitudes)
+        points = np.column_stack((latitudes, longitudes, weights))
+        if not np.isfinite(points).all():
+            raise ValueError("data may not contain NaNs or infinite values.")
+        self.data = points.tolist()
+
+
+# Function to render a folium map to the same iframe HTML as
+# m._repr_html_(), but with element ids numbered in creation order instead of
+# random UUIDs, so a map always renders to the same bytes wherever it runs
+def render_map_iframe(m):
+    figure = Figure()
+    m.add_to(figure)
+    elements = [figure, figure.header, figure.html, figure.script]
+    for element in elements:
+        elements.extend(element._children.values())
+    for number, element in enumerate(elements):
+        element._id = f"{number:032x}"
+    return figure._repr_html_()
+
+
+# Function to generate map HTML
+def generate_map_html(species, latitudes, longitudes, map_center, bounds, weights=None):
+    m = folium.Map(location=map_center)
+    CoordinateHeatMap(
+        latitudes,
+        longitudes,
+        weights,
+        min_opacity=HEAT_LAYER_OPTIONS["minOpacity"],
+        max_zoom=HEAT_LAYER_OPTIONS["maxZoom"],
+        radius=HEAT_LAYER_OPTIONS["radius"],
+        blur=HEAT_LAYER_OPTIONS["blur"],
+    ).add_to(m)
+    m.fit_bounds(bounds)
+    return render_map_iframe(m)
+
+
+# Function to generate map HTML over a pre-rendered heat tile pyramid
+def generate_tile_map_html(map_center, bounds, tile_url, max_native_zoom):
+    m = folium.Map(location=map_center)
+    folium.TileLayer(
+        tiles=tile_url,
+        attr="iNaturalist",
+        name="Heatmap",
+        overlay=True,
+        control=False,
+        max_native_zoom=max_native_zoom,
+    ).add_to(m)
+    m.fit_bounds(bounds)
+    return render_map_iframe(m)
+
+
+# Function to render one map in a worker process, returning its HTML and
+# how long it took
+def render_map_job(job):
+    started_at = time.perf_counter()
+    html = generate_map_html(*job)
+    return html, time.perf_counter() - started_at
+
+
+# The generators run at module level, so worker processes must be forked:
+# spawned workers would re-import and re-run the whole generator script
+def can_fork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+# Coordinates in the shared map data file are stored as integers in units of
+# 1e-5 degrees (about 1 m), each one relative to the previous point
+COORDINATE_SCALE = 100000
+# Maps rendering or waiting in the process pool per worker
+JOBS_PER_WORKER = 4
+# Part of every render cache key; bump it whenever generate_map_html or
+# generate_tile_map_html change what they produce
+RENDER_VERSION = f"1/folium-{folium.__version__}"
+
+
+# Function to register the rendering options shared by all generators
+def add_render_arguments(parser):
+    parser.add_argument(
+        "--render-mode",
+        choices=["iframe", "data"],
+        default="iframe",
+        help=(
+            "iframe: embed a standalone folium map per species; "
+            "data: write all coordinates to one shared file and let heatmaps.js "
+            "draw each map with one Leaflet instance as it scrolls into view"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes used to render iframe maps (default: 1, no pool)",
+    )
+    parser.add_argument(
+        "--grid-cell-meters",
+        type=float,
+        default=0,
+        help=(
+            "bin heatmap points onto a grid of this cell size before rendering "
+            "(default: 0, no binning)"
+        ),
+    )
+    parser.add_argument(
+        "--accuracy-weighting",
+        action="store_true",
+        help="down-weight observations with a poor positional accuracy",
+    )
+    parser.add_argument(
+        "--render-cache",
+        default=DEFAULT_CACHE_DIR,
+        help=(
+            "directory caching rendered iframe maps between builds "
+            f"(default: {DEFAULT_CACHE_DIR}; 'none' disables it)"
+        ),
+    )
+    parser.add_argument(
+        "--render-cache-mb",
+        type=float,
+        default=DEFAULT_CACHE_MB,
+        help=f"size bound of the render cache (default: {DEFAULT_CACHE_MB} MB)",
+    )
+
+
+# Function to delta-encode coordinates as a flat [dlat, dlon, dlat, dlon, ...]
+# list of integers, which is far shorter as JSON than the raw floats
+def encode_coordinates(latitudes, longitudes):
+    points = np.column_stack((latitudes, longitudes))
+    quantized = np.rint(points * COORDINATE_SCALE).astype(np.int64)
+    deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return deltas.ravel().tolist()
+
+
+# Renders the map fragment for each species. In "iframe" mode this is the
+# standalone folium document; in "data" mode it is an empty placeholder and
+# the coordinates are collected into a single data file for heatmaps.js,
+# which creates each map on scroll and tears it down again when far away.
+# With a render cache, iframe maps whose inputs have not changed since an
+# earlier build are read back instead of rendered again.
+class MapRenderer:
+    def __init__(
+        self,
+        mode="iframe",
+        data_path="heatmaps_data.json",
+        grid_cell_meters=0,
+        accuracy_weighting=False,
+        workers=1,
+        cache=None,
+    ):
+        self.mode = mode
+        self.data_path = data_path
+        self.grid_cell_meters = grid_cell_meters
+        self.accuracy_weighting = accuracy_weighting
+        self.workers = workers
+        self.cache = cache
+        self.maps = {}
+        # Seconds spent rendering each map, by map id
+        self.render_times = {}
+
+    @classmethod
+    def from_args(cls, args, data_path):
+        cache = None
+        if args.render_mode == "iframe" and args.render_cache != "none":
+            cache = RenderCache(args.render_cache, args.render_cache_mb * 1e6)
+        return cls(
+            args.render_mode,
+            data_path,
+            grid_cell_meters=args.grid_cell_meters,
+            accuracy_weighting=args.accuracy_weighting,
+            workers=args.workers,
+            cache=cache,
+        )
+
+    # Function to get the (latitudes, longitudes, weights) fed to the heat
+    # layer; weights is None when every point counts once. Binning uses the
+    # grid of reference_latitude when given (see bin_coordinates).
+    def heat_points(self, summary, reference_latitude=None):
+        if "heat_points" in summary:
+            # Already weighted and binned, e.g. by combined_heat_points
+            return summary["heat_points"]
+        latitudes = summary["latitudes"]
+        longitudes = summary["longitudes"]
+        weights = None
+        if self.accuracy_weighting:
+            weights = accuracy_weights(summary["accuracies"])
+        if self.grid_cell_meters > 0:
+            latitudes, longitudes, weights = bin_coordinates(
+                latitudes,
+                longitudes,
+                self.grid_cell_meters,
+                weights,
+                reference_latitude,
+            )
+        return latitudes, longitudes, weights
+
+    # Function to get the heat points of many summaries drawn as one map,
+    # taking the summaries one at a time. With a binning grid each summary is
+    # binned on the grid of reference_latitude and only its cells are kept,
+    # then the cells are merged; without one every point is drawn, so all of
+    # them end up in memory together.
+    def combined_heat_points(self, summaries, reference_latitude):
+        parts = [self.heat_points(summary, reference_latitude) for summary in summaries]
+        latitudes = np.concatenate([part[0] for part in parts])
+        longitudes = np.concatenate([part[1] for part in parts])
+        weights = None
+        if any(part[2] is not None for part in parts):
+            weights = np.concatenate(
+                [
+                    part[2] if part[2] is not None else np.ones_like(part[0])
+                    for part in parts
+                ]
+            )
+        if self.grid_cell_meters > 0:
+            return bin_coordinates(
+                latitudes,
+                longitudes,
+                self.grid_cell_meters,
+                weights,
+                reference_latitude,
+            )
+        return latitudes, longitudes, weights
+
+    # Function to get the generate_map_html arguments for a map
+    def map_job(self, map_id, summary):
+        latitudes, longitudes, weights = self.heat_points(summary)
+        return (
+            map_id,
+            latitudes,
+            longitudes,
+            summary["center"],
+            summary["bounds"],
+            weights,
+        )
+
+    # Function to render iframe map jobs, yielding their HTML in order. Jobs
+    # found in the render cache are read back; the others are rendered, in
+    # a process pool with more than one worker, and added to the cache. Jobs
+    # are taken from the iterable as they are needed, keeping at most
+    # JOBS_PER_WORKER per worker in flight, so the point arrays of maps that
+    # are not being rendered yet need not be in memory.
+    def render_jobs(self, jobs):
+        if self.workers <= 1 or not can_fork():
+            for job in jobs:
+                yield self.finish_job(*self.start_job(job))
+            return
+        pending = deque()
+        with ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            for job in jobs:
+                pending.append(self.start_job(job, executor))
+                if len(pending) >= self.workers * JOBS_PER_WORKER:
+                    yield self.finish_job(*pending.popleft())
+            while pending:
+                yield self.finish_job(*pending.popleft())
+
+    # Function to look a job up in the render cache, or start rendering it
+    # (in the executor when given), returning (map_id, cache key, result)
+    def start_job(self, job, executor=None):
+        key = None
+        if self.cache:
+            key = self.cache.key(RENDER_VERSION, *job)
+            html = self.cache.get(key)
+            if html is not None:
+                return job[0], key, html
+        if executor:
+            return job[0], key, executor.submit(render_map_job, job)
+        return job[0], key, render_map_job(job)
+
+    # Function to get the HTML of a started job, recording freshly rendered
+    # maps in the render times and the cache
+    def finish_job(self, map_id, key, result):
+        if isinstance(result, str):
+            return result
+        if isinstance(result, Future):
+            result = result.result()
+        html, seconds = result
+        self.render_times[map_id] = seconds
+        if self.cache:
+            self.cache.put(key, html)
+        return html
+
+    def render(self, map_id, summary):
+        if self.mode == "iframe":
+            return self.finish_job(*self.start_job(self.map_job(map_id, summary)))
+        started_at = time.perf_counter()
+        latitudes, longitudes, weights = self.heat_points(summary)
+        entry = {
+            "center": [round(value, 6) for value in summary["center"]],
+            "bounds": [
+                [round(value, 6) for value in pair] for pair in summary["bounds"]
+            ],
+            "points": encode_coordinates(latitudes, longitudes),
+        }
+        if weights is not None:
+            entry["weights"] = np.round(weights, 3).tolist()
+        self.maps[map_id] = entry
+        self.render_times[map_id] = time.perf_counter() - started_at
+        return self.placeholder_html(map_id)
+
+    # Function to render many (map_id, summary) pairs, yielding their HTML in
+    # order. With more than one worker, iframe maps are rendered across a
+    # process pool while the caller assembles pages from the first results.
+    # Element ids are deterministic, so the output matches the serial path.
+    def render_many(self, items):
+        if self.mode != "iframe":
+            for map_id, summary in items:
+                yield self.render(map_id, summary)
+            return
+        yield from self.render_jobs(
+            self.map_job(map_id, summary) for map_id, summary in items
+        )
+
+    # Function to render a map showing a pre-rendered heat tile pyramid
+    # (see heat_tiles.build_heat_tiles) instead of individual points
+    def render_tiles(self, map_id, summary, tile_url, max_native_zoom):
+        if self.mode == "iframe":
+            return generate_tile_map_html(
+                summary["center"], summary["bounds"], tile_url, max_native_zoom
+            )
+        self.maps[map_id] = {
+            "center": [round(value, 6) for value in summary["center"]],
+            "bounds": [
+                [round(value, 6) for value in pair] for pair in summary["bounds"]
+            ],
+            "tiles": tile_url,
+            "maxNativeZoom": max_native_zoom,
+        }
+        return self.placeholder_html(map_id)
+
+    # Function to get the empty div heatmaps.js draws a map into
+    def placeholder_html(self, map_id):
+        return (
+            f'<div class="heatmap" data-map-id="{map_id}" '
+            'style="width: 100%; height: 100%;"></div>'
+        )
+
+    # HTML to append at the end of each page body
+    @property
+    def script_html(self):
+        if self.mode == "iframe":
+            return ""
+        return f'<script src="heatmaps.js" data-map-data="{self.data_path}"></script>\n'
+
+    # Function to write the shared data file once all maps have been rendered,
+    # through the build's PageWriter so it is only replaced when it changed
+    def write_data(self, page_writer):
+        if self.mode == "iframe":
+            if self.cache:
+                print(
+                    f"Render cache: {self.cache.hits} maps reused, "
+                    f"{self.cache.misses} rendered"
+                )
+            return
+        with page_writer.open(self.data_path) as f:
+            json.dump(
+                {
+                    "scale": COORDINATE_SCALE,
+                    "heatOptions": HEAT_LAYER_OPTIONS,
+                    "maps": self.maps,
+                },
+                f,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        print(f"Map data saved as {self.data_path}")
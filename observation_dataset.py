@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+from observation_records import ObservationRecord
+
+# On-disk layout of the observation store: a directory of hive-style year
+# partitions (year=2019/, ..., year=unknown/), each holding one .npy file per
+# ObservationRecord field, so a column can be memory-mapped on its own, e.g.
+#
+#   observation_store/
+#     dataset.json                      version, sync state, current generation
+#     generation_000003/year=2019/id.npy
+#     generation_000003/year=2019/taxon_name.codes.npy
+#     generation_000003/year=2019/taxon_name.vocab.npy
+#
+# Every save writes a new generation directory and then swaps dataset.json to
+# point at it, so readers never see a half-written dataset.
+# Bumped whenever the stored columns change; older datasets are refetched
+DATASET_VERSION = 2
+MANIFEST_NAME = "dataset.json"
+# Numeric fields and the value stored in place of a missing one
+NUMERIC_COLUMNS = {
+    "id": ("<i8", None),
+    "latitude": ("<f8", None),
+    "longitude": ("<f8", None),
+    "positional_accuracy": ("<f8", np.nan),
+    "taxon_id": ("<i8", -1),
+}
+# Text fields are dictionary-encoded: int32 codes into a sorted vocabulary of
+# the partition's distinct values (stored as UTF-8 bytes), with -1 for None
+TEXT_COLUMNS = (
+    "observed_on",
+    "photo_url",
+    "license_code",
+    "uri",
+    "user_login",
+    "taxon_name",
+    "updated_at",
+)
+UNKNOWN_YEAR = "unknown"
+
+
+# Function to pick the year partition of a record from its observation date
+def partition_year(record):
+    observed_on = record.observed_on
+    if isinstance(observed_on, str) and observed_on[:4].isdigit():
+        return observed_on[:4]
+    return UNKNOWN_YEAR
+
+
+# Function to read the dataset manifest, or None when there is no dataset
+# written by this version at path
+def load_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != DATASET_VERSION:
+        print(f"Ignoring {path}: written by an older version")
+        return None
+    return manifest
+
+
+# Function to dictionary-encode a list of strings (or None)
+def encode_text(values):
+    present = np.array([value is not None for value in values], dtype=bool)
+    vocabulary, inverse = np.unique(
+        np.array([value for value in values if value is not None], dtype=str),
+        return_inverse=True,
+    )
+    codes = np.full(len(values), -1, dtype=np.int32)
+    codes[present] = inverse
+    return codes, np.char.encode(vocabulary, "utf-8")
+
+
+# Function to read the vocabulary of a text column, with None appended so
+# that code -1 picks it
+def read_vocabulary(directory, name):
+    vocabulary = np.load(os.path.join(directory, f"{name}.vocab.npy"))
+    return [value.decode("utf-8") for value in vocabulary.tolist()] + [None]
+
+
+# Function to write the records of one partition as column files
+def write_partition(directory, records):
+    os.makedirs(directory)
+    for name, (dtype, missing) in NUMERIC_COLUMNS.items():
+        values = [getattr(record, name) for record in records]
+        if missing is not None:
+            values = [missing if value in (None, "") else value for value in values]
+        np.save(os.path.join(directory, f"{name}.npy"), np.array(values, dtype=dtype))
+    for name in TEXT_COLUMNS:
+        codes, vocabulary = encode_text([getattr(record, name) for record in records])
+        np.save(os.path.join(directory, f"{name}.codes.npy"), codes)
+        np.save(os.path.join(directory, f"{name}.vocab.npy"), vocabulary)
+
+
+# Function to save records and sync state (last_synced_at, max_id...) as a
+# new generation of the dataset, removing the previous ones once it is live
+def write_dataset(path, records, state):
+    os.makedirs(path, exist_ok=True)
+    number = 1 + max(
+        (
+            int(name.split("_")[1])
+            for name in os.listdir(path)
+            if name.startswith("generation_")
+        ),
+        default=0,
+    )
+    generation = f"generation_{number:06d}"
+
+    partitions = {}
+    for record in records:
+        partitions.setdefault(partition_year(record), []).append(record)
+    for year, year_records in sorted(partitions.items()):
+        write_partition(os.path.join(path, generation, f"year={year}"), year_records)
+
+    manifest = {
+        "version": DATASET_VERSION,
+        **state,
+        "generation": generation,
+        "partitions": {
+            year: len(year_records) for year, year_records in sorted(partitions.items())
+        },
+    }
+    tmp_path = os.path.join(path, f"{MANIFEST_NAME}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_NAME))
+
+    for name in os.listdir(path):
+        if name.startswith("generation_") and name != generation:
+            shutil.rmtree(os.path.join(path, name))
+
+
+# Function to read columns of the dataset as NumPy arrays, concatenated over
+# the requested years (all by default). Numeric columns keep their missing
+# value sentinels (NaN accuracy, -1 taxon id); text columns are decoded to
+# object arrays with None for missing values. Meant for analysis outside the
+# generators, e.g. pandas.DataFrame(read_columns("observation_store")).
+def read_columns(path, columns=None, years=None):
+    manifest = load_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No observation dataset at {path}")
+    columns = columns or [*NUMERIC_COLUMNS, *TEXT_COLUMNS]
+    years = [year for year in manifest["partitions"] if years is None or year in years]
+    parts = {name: [] for name in columns}
+    for year in years:
+        directory = os.path.join(path, manifest["generation"], f"year={year}")
+        for name in columns:
+            parts[name].append(read_column(directory, name))
+    return {
+        name: np.concatenate(arrays) if arrays else np.empty(0)
+        for name, arrays in parts.items()
+    }
+
+
+# Function to read one column of a partition; numeric columns are
+# memory-mapped rather than read into memory
+def read_column(directory, name):
+    if name in NUMERIC_COLUMNS:
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+    codes = np.load(os.path.join(directory, f"{name}.codes.npy"))
+    return np.array(read_vocabulary(directory, name), dtype=object)[codes]
+
+
+# Function to load the dataset back as records and its sync state, or None
+# when there is no dataset at path
+def read_dataset(path):
+    manifest = load_manifest(path)
+    if manifest is None:
+        return None
+    records = []
+    for year in manifest["partitions"]:
+        directory = os.path.join(path, manifest["generation"], f"year={year}")
+        fields = []
+        for name, (_, missing) in NUMERIC_COLUMNS.items():
+            values = np.load(os.path.join(directory, f"{name}.npy")).tolist()
+            if name == "positional_accuracy":
+                values = [None if value != value else value for value in values]
+            elif missing is not None:
+                values = ["" if value == missing else value for value in values]
+            fields.append(values)
+        for name in TEXT_COLUMNS:
+            codes = np.load(os.path.join(directory, f"{name}.codes.npy")).tolist()
+            vocabulary = read_vocabulary(directory, name)
+            fields.append([vocabulary[code] for code in codes])
+        records.extend(
+            ObservationRecord(**dict(zip([*NUMERIC_COLUMNS, *TEXT_COLUMNS], values)))
+            for values in zip(*fields)
+        )
+    state = {
+        key: value
+        for key, value in manifest.items()
+        if key not in ("version", "generation", "partitions")
+    }
+    return records, state
+
+
+if __name__ == "__main__":
+    from inat_sync import (
+        DEFAULT_STORE_PATH,
+        empty_store,
+        merge_pages,
+        read_captured_pages,
+        save_store,
+    )
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Summarise the local observation dataset, or import captured API "
+            "responses into it."
+        )
+    )
+    parser.add_argument(
+        "--store",
+        default=DEFAULT_STORE_PATH,
+        help=f"observation dataset directory (default: {DEFAULT_STORE_PATH})",
+    )
+    parser.add_argument(
+        "--import",
+        dest="import_path",
+        metavar="PATH",
+        help=(
+            "replace the dataset with the records in a JSON file with a list of "
+            "observations or a page of results, or a directory of such files"
+        ),
+    )
+    args = parser.parse_args()
+
+    if args.import_path:
+        store = empty_store()
+        merge_pages(store, read_captured_pages(args.import_path))
+        save_store(store, args.store)
+        print(f"Imported {len(store['observations'])} observations into {args.store}")
+
+    manifest = load_manifest(args.store)
+    if manifest is None:
+        print(f"No observation dataset at {args.store}")
+    else:
+        print(
+            f"{sum(manifest['partitions'].values())} observations in {args.store}, "
+            f"last synced at {manifest['last_synced_at']}"
+        )
+        for year, count in manifest["partitions"].items():
+            print(f"  {year}: {count}")
@@ -0,0 +1,88 @@
+# Compact observation record kept in place of the raw API dict. A raw record
+# carries more than 60 keys (identifications, photos, taxon ancestry...), but
+# the generators only read the handful of fields below.
+class ObservationRecord:
+    __slots__ = (
+        "id",
+        "latitude",
+        "longitude",
+        "positional_accuracy",
+        "observed_on",
+        "photo_url",
+        "license_code",
+        "uri",
+        "user_login",
+        "taxon_id",
+        "taxon_name",
+        "updated_at",
+    )
+
+    def __init__(
+        self,
+        id,
+        latitude,
+        longitude,
+        positional_accuracy,
+        observed_on,
+        photo_url,
+        license_code,
+        uri,
+        user_login,
+        taxon_id,
+        taxon_name,
+        updated_at,
+    ):
+        self.id = id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.positional_accuracy = positional_accuracy
+        self.observed_on = observed_on
+        self.photo_url = photo_url
+        self.license_code = license_code
+        self.uri = uri
+        self.user_login = user_login
+        self.taxon_id = taxon_id
+        self.taxon_name = taxon_name
+        self.updated_at = updated_at
+
+    # Function to project a raw API observation, or None when it has no
+    # coordinates or photo and so cannot be shown on the site
+    @classmethod
+    def from_api(cls, observation):
+        if not (
+            "geojson" in observation
+            and "coordinates" in observation["geojson"]
+            and "photos" in observation
+            and observation["photos"]
+        ):
+            return None
+        photo = observation["photos"][0]
+        return cls(
+            id=observation["id"],
+            latitude=observation["geojson"]["coordinates"][1],
+            longitude=observation["geojson"]["coordinates"][0],
+            positional_accuracy=observation.get("positional_accuracy"),
+            observed_on=observation.get("observed_on", "Unknown"),
+            photo_url=photo.get("url") or "",
+            license_code=(
+                photo.get("license_code") if "license_code" in observation else "N/A"
+            ),
+            uri=observation.get("uri", ""),
+            user_login=(
+                observation["user"]["login"] if "user" in observation else "Unknown"
+            ),
+            taxon_id=observation["taxon"]["id"] if "taxon" in observation else "",
+            taxon_name=(
+                observation["taxon"]["name"] if "taxon" in observation else "Unknown"
+            ),
+            updated_at=observation.get("updated_at"),
+        )
+
+    # Functions to round-trip the record as a flat list, for checkpointed sync
+    # pages and for comparing a fetched record with the stored one
+    def to_list(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
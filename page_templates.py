@@ -0,0 +1,446 @@
+import hashlib
+import json
+import math
+
+from jinja2 import Environment
+
+# Page layouts used by the generators. Each template is compiled once when this
+# module is imported and rendered straight into the output file with
+# write_template, so a page is never held in memory as one big string.
+# Autoescaping is off: map fragments and Wikipedia extracts are already HTML.
+ENVIRONMENT = Environment(autoescape=False, keep_trailing_newline=True)
+
+
+# Shared species navigation index written with --species-index
+SPECIES_INDEX_PATH = "species_index.json"
+# Species shown on each page of the paginated sites
+SPECIES_PER_PAGE = 10
+
+
+# Function to compile a page template
+def compile_template(source):
+    return ENVIRONMENT.from_string(source)
+
+
+# Function to render a template piece by piece into an open file
+def write_template(f, template, **context):
+    template.stream(**context).dump(f)
+
+
+# Function to extract the details shown for an observation
+def observation_details(observation):
+    user_name = observation.user_login
+    return {
+        "img_url": observation.photo_url.replace("square", "medium"),
+        "license": observation.license_code,
+        "observation_url": observation.uri,
+        "user_name": user_name,
+        "user_profile_url": (
+            f"https://www.inaturalist.org/observations?iconic_taxa=Aves&place_id=125852&subview=map&user_id={user_name}"
+            if user_name != "Unknown"
+            else ""
+        ),
+        "observation_date": observation.observed_on,
+    }
+
+
+# Function to get the iNaturalist link for a species
+def species_id_url(taxon_id):
+    return f"https://www.inaturalist.org/observations?iconic_taxa=Aves&place_id=125852&subview=map&taxon_id={taxon_id}"
+
+
+# Closing part of the single page
+PAGE_END = compile_template("""{{ script_html }}
+</body>
+</html>
+""")
+
+
+# Single page with every species (heatmap_generator.py)
+BY_SPECIES_HEADER = compile_template("""
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Heatmaps</title>
+    <style>
+        body { font-family: Arial, sans-serif; text-align: center; }
+        .map-container { margin-bottom: 20px; }
+        .map-title { font-size: 1.2em; margin-top: 20px; font-style: italic; }
+        .species-container { display: flex; justify-content: center; align-items: center; margin-bottom: 20px; }
+        .species-info { margin-left: 20px; text-align: left; }
+        .species-info img { max-width: 300px; height: auto; }
+        .subheader { font-size: 1em; margin-top: 15px; font-style: normal; }
+    </style>
+    <script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
+    <script src="https://cdn.jsdelivr.net/gh/python-visualization/folium@main/folium/templates/leaflet_heat.min.js"></script>
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"/>
+</head>
+<body>
+    <h2>Observações de aves no campus da USP via iNaturalist</h2>
+""")
+
+BY_SPECIES_COMPLETE_MAP = compile_template("""
+<div class="species-container">
+    <div class="map-container">
+        <div class="map-title">Complete Heatmap</div>
+        <div style="width: 100%; height: 400px;">{{ map_html }}</div>
+    </div>
+</div>
+""")
+
+BY_SPECIES_SPECIES = compile_template("""
+    <div class="species-container">
+        <div class="map-container">
+            <div class="map-title"><a href="{{ species_id_url }}" target="_blank">{{ number }}. {{ species }}</a></div>
+            <div class="subheader">Research Grade observations: {{ count }}</div>
+            <div style="width: 100%; height: 400px;">{{ map_html }}</div>
+        </div>
+        <div class="species-info">
+            <a href="{{ first.observation_url }}" target="_blank">
+                <img src="{{ first.img_url }}" alt="{{ species }}">
+            </a>
+            <p><a href="{{ first.user_profile_url }}" target="_blank">{{ first.user_name }}</a>, {{ first.license }} ({{ first.observation_date }})</p>
+        </div>
+    </div>
+    """)
+
+
+# Paginated pages (paginated_heatmap_generator.py)
+PAGINATED_HEADER = compile_template("""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Heatmaps - Página {{ page_number }}</title>
+        <style>
+            body { font-family: Arial, sans-serif; text-align: center; }
+            .map-container { margin-bottom: 20px; }
+            .map-title { font-size: 1.2em; margin-top: 20px; font-style: italic; }
+            .species-container { display: flex; justify-content: center; align-items: center; margin-bottom: 20px; }
+            .species-info { margin-left: 20px; text-align: left; }
+            .species-info img { max-width: 300px; height: auto; }
+            .subheader { font-size: 1em; margin-top: 15px; font-style: normal; }
+            .navbar { display: flex; justify-content: center; margin-bottom: 20px; }
+            .navbar select { font-size: 1em; padding: 5px; }
+            .bottom-nav { display: flex; justify-content: center; margin-top: 20px; }
+            .bottom-nav a { margin: 0 5px; text-decoration: none; font-size: 1.2em; padding: 10px 20px; background-color: #007BFF; color: white; border-radius: 5px; }
+            .bottom-nav a:hover { background-color: #0056b3; }
+            .image-header { font-weight: bold; margin-top: 10px; }
+        </style>
+        <script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
+        <script src="https://cdn.jsdelivr.net/gh/python-visualization/folium@main/folium/templates/leaflet_heat.min.js"></script>
+        <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"/>
+    </head>
+    <body>
+        <h2>Observações de aves no campus da USP via iNaturalist</h2>
+        <div class="navbar">
+            <select id="species-select" onchange="navigateToSpecies()">
+                <option value="">Selecione uma espécie</option>
+    """)
+
+PAGINATED_SPECIES = compile_template("""
+        <div class="species-container" id="{{ anchor }}">
+            <div class="map-container">
+                <div class="map-title"><a href="{{ species_id_url }}" target="_blank">{{ number }}. {{ species }}</a></div>
+                <div class="subheader">Observações em Nível de Pesquisa: {{ count }}</div>
+                <div style="width: 100%; height: 400px;">{{ map_html }}</div>
+            </div>
+            <div class="species-info">
+                <div class="image-header">Primeira Observação</div>
+                <a href="{{ first.observation_url }}" target="_blank">
+                    <img src="{{ first.img_url }}" alt="{{ species }}">
+                </a>
+                <p><a href="{{ first.user_profile_url }}" target="_blank">{{ first.user_name }}</a>, {{ first.license }} ({{ first.observation_date }})</p>
+                <div class="image-header">Observação Mais Recente</div>
+                <a href="{{ recent.observation_url }}" target="_blank">
+                    <img src="{{ recent.img_url }}" alt="{{ species }}">
+                </a>
+                <p><a href="{{ recent.user_profile_url }}" target="_blank">{{ recent.user_name }}</a>, {{ recent.license }} ({{ recent.observation_date }})</p>
+            </div>
+        </div>
+        """)
+
+
+# Paginated pages with Wikipedia descriptions
+# (paginated_heatmap_with_wikipedia_generator.py)
+WIKIPEDIA_HEADER = compile_template("""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Heatmaps - Página {{ page_number }}</title>
+        <style>
+            body { font-family: Arial, sans-serif; text-align: center; }
+            .map-container { margin-bottom: 20px; }
+            .map-title { font-size: 1.2em; margin-top: 20px; font-style: italic; }
+            .species-container { display: flex; justify-content: center; align-items: center; margin-bottom: 20px; }
+            .species-info { margin-left: 20px; text-align: left; }
+            .species-info img { max-width: 300px; height: auto; }
+            .subheader { font-size: 1em; margin-top: 15px; font-style: normal; }
+            .navbar { display: flex; justify-content: center; margin-bottom: 20px; }
+            .navbar select { font-size: 1em; padding: 5px; }
+            .bottom-nav { display: flex; justify-content: center; margin-top: 20px; }
+            .bottom-nav a { margin: 0 5px; text-decoration: none; font-size: 1.2em; padding: 10px 20px; background-color: #007BFF; color: white; border-radius: 5px; }
+            .bottom-nav a:hover { background-color: #0056b3; }
+            .image-header { font-weight: bold; margin-top: 10px; }
+            .image-row { display: flex; justify-content: space-around; align-items: center; }
+            .species-description { margin-top: 20px; text-align: left; max-width: 800px; margin-left: auto; margin-right: auto; }
+            .footer { margin-top: 40px; font-size: 0.9em; color: #555; }
+        </style>
+        <script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
+        <script src="https://cdn.jsdelivr.net/gh/python-visualization/folium@main/folium/templates/leaflet_heat.min.js"></script>
+        <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"/>
+    </head>
+    <body>
+        <h2>Observações de aves no campus da USP via iNaturalist</h2>
+        <div class="navbar">
+            <select id="species-select" onchange="navigateToSpecies()">
+                <option value="">Selecione uma espécie</option>
+    """)
+
+WIKIPEDIA_SPECIES = compile_template("""
+        <div class="species-container" id="{{ anchor }}">
+            <div class="map-container">
+                <div class="map-title"><a href="{{ species_id_url }}" target="_blank">{{ number }}. {{ species }}</a></div>
+                <div class="subheader">Observações em Nível de Pesquisa: {{ count }}</div>
+                <div style="width: 100%; height: 400px;">{{ map_html }}</div>
+            </div>
+            <div class="species-info">
+                <div class="image-row">
+                    <div>
+                        <div class="image-header">Primeira Observação</div>
+                        <a href="{{ first.observation_url }}" target="_blank">
+                            <img src="{{ first.img_url }}" alt="{{ species }}">
+                        </a>
+                        <p><a href="{{ first.user_profile_url }}" target="_blank">{{ first.user_name }}</a>, {{ first.license }} ({{ first.observation_date }})</p>
+                    </div>
+                    <div>
+                        <div class="image-header">Observação Mais Recente</div>
+                        <a href="{{ recent.observation_url }}" target="_blank">
+                            <img src="{{ recent.img_url }}" alt="{{ species }}">
+                        </a>
+                        <p><a href="{{ recent.user_profile_url }}" target="_blank">{{ recent.user_name }}</a>, {{ recent.license }} ({{ recent.observation_date }})</p>
+                    </div>
+                </div>
+                <div class="species-description">
+                    <p>{{ description }}</p>
+                    <p><a href="{{ wikipedia_link }}" target="_blank">Link para Wikipedia</a></p>
+                </div>
+            </div>
+        </div>
+        """)
+
+WIKIPEDIA_FOOTER = compile_template("""
+    <div class="footer">
+        <p>Desenvolvido com ♥ por Tiago Lubiana.</p>
+        <p><a href="https://github.com/lubianat/inat_heatmap" target="_blank">Repositório no GitHub</a></p>
+        <p>Conteúdo da Wikipedia licenciado em <a href="https://creativecommons.org/licenses/by-sa/4.0/" target="_blank">CC-BY-SA</a></p>
+        <p>Última atualização: <span class="last-update"></span></p>
+        <script src="last_update.js"></script>
+    </div>
+    """)
+
+SOBRE_PAGE = compile_template("""
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Sobre o projeto</title>
+    <style>
+        body { font-family: Arial, sans-serif; text-align: center; margin: 20px; }
+        .content { max-width: 800px; margin: auto; text-align: left; }
+        .footer { margin-top: 40px; font-size: 0.9em; color: #555; text-align: center; }
+    </style>
+</head>
+<body>
+    <h2>Sobre o projeto</h2>
+    <div class="content">
+        <p>Este projeto foi desenvolvido por Tiago Lubiana para visualizar as observações de aves no campus da USP utilizando dados do iNaturalist.</p>
+        <p>As observações são exibidas em um mapa de calor, juntamente com a primeira e a mais recente observação de cada espécie, bem como uma breve descrição retirada da Wikipedia.</p>
+        <p>O código-fonte do projeto está disponível no GitHub: <a href="https://github.com/lubianat/inat_heatmap" target="_blank">Repositório no GitHub</a></p>
+    </div>
+    <div class="footer">
+        <p>Licença: <a href="https://creativecommons.org/licenses/by/4.0/" target="_blank">CC-BY</a></p>
+        <p>Conteúdo da Wikipedia licenciado em <a href="https://creativecommons.org/licenses/by-sa/4.0/" target="_blank">CC-BY-SA</a></p>
+        <p>Última atualização: <span class="last-update"></span></p>
+        <script src="last_update.js"></script>
+    </div>
+</body>
+</html>
+""")
+
+README = compile_template("""
+# Visualização de Observações de Aves na USP
+
+Este projeto foi desenvolvido por Tiago Lubiana para visualizar as observações de aves no campus da USP utilizando dados do iNaturalist.
+
+## Sobre o projeto
+
+As observações são exibidas em um mapa de calor, juntamente com a primeira e a mais recente observação de cada espécie, bem como uma breve descrição retirada da Wikipedia.
+
+## Licença
+
+O código-fonte deste projeto está licenciado sob a licença [CC-BY](https://creativecommons.org/licenses/by/4.0/).
+
+O conteúdo da Wikipedia está licenciado sob a licença [CC-BY-SA](https://creativecommons.org/licenses/by-sa/4.0/).
+
+## Última atualização
+
+A data da última atualização é exibida no rodapé das páginas do site.
+""")
+
+# Shared update stamp loaded by every page footer, so a new build date does
+# not change the pages themselves
+LAST_UPDATE_SCRIPT = compile_template(
+    """document.querySelectorAll(".last-update").forEach(function (element) {
+    element.textContent = "{{ last_update_date }}";
+});
+"""
+)
+
+
+# Pieces shared by both paginated layouts
+SPECIES_DROPDOWN = compile_template(
+    """{% for option in options %}<option value="heatmaps_page_{{ option.page }}.html#{{ option.anchor }}">{{ option.name }}</option>{% endfor %}
+            </select>
+        </div>
+    """
+)
+
+# Search box filled from the shared species index by species_nav.js, used
+# instead of SPECIES_DROPDOWN so pages do not grow with the species count
+SPECIES_INDEX_NAV = compile_template("""
+            </select>
+            <input id="species-search" type="search" placeholder="Buscar espécie" autocomplete="off">
+        </div>
+        <script src="species_nav.js" data-species-index="{{ index_url }}"></script>
+    """)
+
+BOTTOM_NAV = compile_template(
+    """<div class="bottom-nav">{% if previous_page %}<a href="heatmaps_page_{{ previous_page }}.html">Anterior</a>{% endif %}{% if next_page %}<a href="heatmaps_page_{{ next_page }}.html">Próxima</a>{% endif %}</div>"""
+)
+
+PAGINATED_END = compile_template("""{{ script_html }}
+    <script>
+        function navigateToSpecies() {
+            var select = document.getElementById('species-select');
+            var page = select.value;
+            if (page) {
+                window.location.href = page;
+            }
+        }
+    </script>
+    </body>
+    </html>
+    """)
+
+
+# Function to register the navigation options of the paginated generators
+def add_navigation_arguments(parser):
+    parser.add_argument(
+        "--species-index",
+        action="store_true",
+        help=(
+            f"write the species list once to {SPECIES_INDEX_PATH} and search it "
+            "with species_nav.js instead of repeating it in every page"
+        ),
+    )
+
+
+# Function to write the species navigation index, one compact
+# [name, anchor, page, count] row per species, returning its URL. Every page
+# embeds the URL, so its version hash covers only what navigation depends on
+# (name, anchor, page): new observations change the counts in the index but
+# leave the pages untouched, and species_nav.js revalidates the index to pick
+# up the new counts.
+def write_species_index(species_options, page_writer, path=SPECIES_INDEX_PATH):
+    rows = [
+        [option["name"], option["anchor"], option["page"], option["count"]]
+        for option in species_options
+    ]
+    with page_writer.open(path) as f:
+        json.dump({"species": rows}, f, ensure_ascii=False, separators=(",", ":"))
+    print(f"Species index saved as {path}")
+    navigation = json.dumps([row[:3] for row in rows], ensure_ascii=False)
+    version = hashlib.sha256(navigation.encode("utf-8")).hexdigest()[:12]
+    return f"{path}?v={version}"
+
+
+# Function to list the entries of the species dropdown (and index) shown on
+# every page of a paginated site
+def species_options(species_list, species_data, species_per_page=SPECIES_PER_PAGE):
+    return [
+        {
+            "page": i // species_per_page + 1,
+            "anchor": species.replace(" ", "_"),
+            "name": species,
+            "count": species_data[species]["count"],
+        }
+        for i, species in enumerate(species_list)
+    ]
+
+
+# Function to write the species pages of a paginated site. species_maps
+# yields the map HTML of each species in list order, so maps can still be
+# rendering while the first pages are written. Passing species_descriptions
+# writes the Wikipedia site, whose species also get a description and a
+# Wikipedia link and whose pages end with the project footer.
+def write_paginated_pages(
+    page_writer,
+    species_list,
+    species_data,
+    species_maps,
+    options,
+    script_html,
+    species_index_url=None,
+    species_descriptions=None,
+    species_per_page=SPECIES_PER_PAGE,
+):
+    wikipedia = species_descriptions is not None
+    header = WIKIPEDIA_HEADER if wikipedia else PAGINATED_HEADER
+    species_template = WIKIPEDIA_SPECIES if wikipedia else PAGINATED_SPECIES
+    total_pages = math.ceil(len(species_list) / species_per_page)
+    for page_num in range(total_pages):
+        with page_writer.open(f"heatmaps_page_{page_num + 1}.html") as f:
+            write_template(f, header, page_number=page_num + 1)
+            if species_index_url:
+                write_template(f, SPECIES_INDEX_NAV, index_url=species_index_url)
+            else:
+                write_template(f, SPECIES_DROPDOWN, options=options)
+
+            # Add species maps for the current page
+            start_idx = page_num * species_per_page
+            end_idx = start_idx + species_per_page
+            for i, species in enumerate(
+                species_list[start_idx:end_idx], start=start_idx + 1
+            ):
+                species_info = species_data[species]
+                wikipedia_fields = {}
+                if wikipedia:
+                    wikipedia_fields = {
+                        "description": species_descriptions.get(
+                            species, "Descrição não disponível."
+                        ),
+                        "wikipedia_link": f"https://pt.wikipedia.org/wiki/{species.replace(' ', '_')}",
+                    }
+                write_template(
+                    f,
+                    species_template,
+                    anchor=species.replace(" ", "_"),
+                    species_id_url=species_id_url(species_info["taxon_id"]),
+                    number=i,
+                    species=species,
+                    count=species_info["count"],
+                    map_html=next(species_maps),
+                    first=observation_details(species_info["first_observation"]),
+                    recent=observation_details(species_info["recent_observation"]),
+                    **wikipedia_fields,
+                )
+
+            # Add bottom navigation links
+            write_template(
+                f,
+                BOTTOM_NAV,
+                previous_page=page_num if page_num > 0 else None,
+                next_page=page_num + 2 if page_num < total_pages - 1 else None,
+            )
+            if wikipedia:
+                write_template(f, WIKIPEDIA_FOOTER)
+            write_template(f, PAGINATED_END, script_html=script_html)
@@ -0,0 +1,74 @@
+import filecmp
+import json
+import os
+from contextlib import contextmanager
+
+DEFAULT_MANIFEST_PATH = "build_manifest.json"
+
+
+# Writes the pages of one generator ("site") so that unchanged pages keep
+# their file untouched. Each page is streamed to a temporary file and only
+# moved over the old one if its contents differ. The pages written by each
+# site are recorded in a manifest, so pages a site no longer produces (e.g.
+# after the species list shrank) are removed on the next build.
+class PageWriter:
+    def __init__(self, site, manifest_path=DEFAULT_MANIFEST_PATH):
+        self.site = site
+        self.manifest_path = manifest_path
+        self.manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        self.written = []
+        self.added = []
+        self.changed = []
+
+    # Function to open a page for writing; the page is published when the
+    # with block ends without an error
+    @contextmanager
+    def open(self, path):
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                yield f
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.written.append(path)
+        if not os.path.exists(path):
+            self.added.append(path)
+        elif filecmp.cmp(tmp_path, path, shallow=False):
+            os.remove(tmp_path)
+            return
+        else:
+            self.changed.append(path)
+        os.replace(tmp_path, path)
+
+    # Function to remove the site's stale pages, save the manifest and print
+    # what changed since the previous build
+    def finish(self):
+        removed = [
+            path
+            for path in self.manifest.get(self.site, [])
+            if path not in self.written and os.path.exists(path)
+        ]
+        for path in removed:
+            os.remove(path)
+        self.manifest[self.site] = self.written
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+        unchanged = len(self.written) - len(self.added) - len(self.changed)
+        print(
+            f"Pages: {len(self.added)} added, {len(self.changed)} changed, "
+            f"{len(removed)} removed, {unchanged} unchanged"
+        )
+        for label, paths in (
+            ("Added", self.added),
+            ("Changed", self.changed),
+            ("Removed", removed),
+        ):
+            if paths:
+                print(f"  {label}: {', '.join(paths)}")
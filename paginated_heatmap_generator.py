@@ -1,269 +1,81 @@
-import pandas as pd
-import folium
-from folium.plugins import HeatMap
-import requests
-import math
-
-# Initialize variables for storing data
-latitudes = []
-longitudes = []
-species_data = {}
-
-# Initial URL for the first page
-url = (
-    "https://api.inaturalist.org/v1/observations"
-    "?place_id=125852&iconic_taxa=Aves&order=desc&order_by=created_at"
-    "&quality_grade=research&captive=false&per_page=200"
+import argparse
+from aggregation import aggregate_species
+from inat_sync import (
+    add_sync_arguments,
+    observation_pages_from_args,
+    observations_from_args,
+    refuse_empty_build,
 )
+from instrumentation import RunReport, add_report_arguments
+from map_rendering import MapRenderer, add_render_arguments
+from page_writer import PageWriter
+from page_templates import (
+    add_navigation_arguments,
+    species_options,
+    write_paginated_pages,
+    write_species_index,
+)
+from streaming_ingest import stream_species
 
-response = requests.get(url)
-
-if response.status_code == 200:
-    r = response.json()
-    total_results = r["total_results"]
-    observations = r["results"]
+parser = argparse.ArgumentParser(
+    description="Generate paginated heatmaps per bird species."
+)
+add_sync_arguments(parser)
+add_render_arguments(parser)
+add_report_arguments(parser)
+add_navigation_arguments(parser)
+args = parser.parse_args()
+run_report = RunReport.from_args(args)
+map_renderer = MapRenderer.from_args(args, "heatmaps_data.json")
+
+run_report.begin("fetch")
+if args.spill_dir:
+    # Stream the feed into per-species files, aggregating as pages arrive
+    species_data = stream_species(observation_pages_from_args(args), args.spill_dir)
 else:
-    print("Failed to fetch data")
-    observations = []
-
-# Fetch remaining pages of results
-while observations:
-    last_id = observations[-1]["id"]
-    for observation in observations:
-        if (
-            "geojson" in observation
-            and "coordinates" in observation["geojson"]
-            and "photos" in observation
-            and observation["photos"]
-        ):
-            lat = observation["geojson"]["coordinates"][1]
-            lon = observation["geojson"]["coordinates"][0]
-            species = (
-                observation["taxon"]["name"] if "taxon" in observation else "Unknown"
-            )
-            if species not in species_data:
-                species_data[species] = {
-                    "latitudes": [],
-                    "longitudes": [],
-                    "observations": [],
-                    "taxon_id": (
-                        observation["taxon"]["id"] if "taxon" in observation else ""
-                    ),
-                }
-            species_data[species]["latitudes"].append(lat)
-            species_data[species]["longitudes"].append(lon)
-            species_data[species]["observations"].append(observation)
-
-            latitudes.append(lat)
-            longitudes.append(lon)
-
-    # Check if there are more results
-    if len(observations) < 200:
-        break
-
-    # Fetch the next page
-    url = (
-        "https://api.inaturalist.org/v1/observations"
-        f"?place_id=125852&iconic_taxa=Aves&order=desc&order_by=created_at"
-        f"&quality_grade=research&captive=false&per_page=200&id_below={last_id}"
-    )
-    response = requests.get(url)
-
-    if response.status_code == 200:
-        observations = response.json()["results"]
-    else:
-        print("Failed to fetch data")
-        break
-
-
-# Function to generate map HTML
-def generate_map_html(species, latitudes, longitudes):
-    df = pd.DataFrame(
-        {"latitude": latitudes, "longitude": longitudes, "count": [1] * len(latitudes)}
-    )
-    heatmap_data = df[["latitude", "longitude", "count"]].values.tolist()
-
-    if latitudes and longitudes:
-        map_center = [
-            sum(latitudes) / len(latitudes),
-            sum(longitudes) / len(longitudes),
-        ]
-        bounds = [[min(latitudes), min(longitudes)], [max(latitudes), max(longitudes)]]
-    else:
-        map_center = [0, 0]
-        bounds = [[0, 0], [0, 0]]
+    # Bring the local observation store up to date (or replay captured pages)
+    observations = observations_from_args(args)
 
-    m = folium.Map(location=map_center)
-    HeatMap(heatmap_data, radius=30).add_to(m)
-    m.fit_bounds(bounds)
-    return m._repr_html_()
+    # Aggregate observations per species
+    run_report.begin("aggregate")
+    all_observations, species_data = aggregate_species(observations)
 
+# Stop before a build without species replaces the published pages
+refuse_empty_build(species_data, args)
 
-# Determine pagination parameters
+# Sort species alphabetically
 species_list = sorted(species_data.keys())
-species_per_page = 10
-total_pages = math.ceil(len(species_list) / species_per_page)
 
-# Create HTML content for each page
-for page_num in range(total_pages):
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Heatmaps - Página {page_num + 1}</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; text-align: center; }}
-            .map-container {{ margin-bottom: 20px; }}
-            .map-title {{ font-size: 1.2em; margin-top: 20px; font-style: italic; }}
-            .species-container {{ display: flex; justify-content: center; align-items: center; margin-bottom: 20px; }}
-            .species-info {{ margin-left: 20px; text-align: left; }}
-            .species-info img {{ max-width: 300px; height: auto; }}
-            .subheader {{ font-size: 1em; margin-top: 15px; font-style: normal; }}
-            .navbar {{ display: flex; justify-content: center; margin-bottom: 20px; }}
-            .navbar select {{ font-size: 1em; padding: 5px; }}
-            .bottom-nav {{ display: flex; justify-content: center; margin-top: 20px; }}
-            .bottom-nav a {{ margin: 0 5px; text-decoration: none; font-size: 1.2em; padding: 10px 20px; background-color: #007BFF; color: white; border-radius: 5px; }}
-            .bottom-nav a:hover {{ background-color: #0056b3; }}
-            .image-header {{ font-weight: bold; margin-top: 10px; }}
-        </style>
-        <script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
-        <script src="https://cdn.jsdelivr.net/gh/python-visualization/folium@main/folium/templates/leaflet_heat.min.js"></script>
-        <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"/>
-    </head>
-    <body>
-        <h2>Observações de aves no campus da USP via iNaturalist</h2>
-        <div class="navbar">
-            <select id="species-select" onchange="navigateToSpecies()">
-                <option value="">Selecione uma espécie</option>
-    """
-
-    # Add species options to the dropdown
-    for i, species in enumerate(species_list):
-        species_page = i // species_per_page
-        species_anchor = f'#{species.replace(" ", "_")}'
-        html_content += f'<option value="heatmaps_page_{species_page + 1}.html{species_anchor}">{species}</option>'
-
-    html_content += """
-            </select>
-        </div>
-    """
-
-    # Add species maps for the current page
-    start_idx = page_num * species_per_page
-    end_idx = start_idx + species_per_page
-    for i, species in enumerate(species_list[start_idx:end_idx], start=start_idx + 1):
-        species_info = species_data[species]
-        latitudes = species_info["latitudes"]
-        longitudes = species_info["longitudes"]
-
-        # Sort observations by date to get the first and most recent observations
-        species_info["observations"].sort(key=lambda x: x["observed_on"])
-        first_observation = species_info["observations"][0]
-        recent_observation = species_info["observations"][-1]
-
-        # Extract observation details
-        def extract_observation_details(observation):
-            img_url = (
-                observation["photos"][0]["url"]
-                if "photos" in observation and observation["photos"]
-                else ""
-            )
-            img_url = img_url.replace("square", "medium") if img_url else ""
-            license = (
-                observation["photos"][0]["license_code"]
-                if "license_code" in observation
-                else "N/A"
-            )
-            observation_url = observation["uri"] if "uri" in observation else ""
-            user_name = (
-                observation["user"]["login"] if "user" in observation else "Unknown"
-            )
-            user_profile_url = (
-                f"https://www.inaturalist.org/observations?iconic_taxa=Aves&place_id=125852&subview=map&user_id={user_name}"
-                if user_name != "Unknown"
-                else ""
-            )
-            observation_date = (
-                observation["observed_on"]
-                if "observed_on" in observation
-                else "Unknown"
-            )
-            return (
-                img_url,
-                license,
-                observation_url,
-                user_name,
-                user_profile_url,
-                observation_date,
-            )
-
-        (
-            first_img_url,
-            first_license,
-            first_observation_url,
-            first_user_name,
-            first_user_profile_url,
-            first_observation_date,
-        ) = extract_observation_details(first_observation)
-        (
-            recent_img_url,
-            recent_license,
-            recent_observation_url,
-            recent_user_name,
-            recent_user_profile_url,
-            recent_observation_date,
-        ) = extract_observation_details(recent_observation)
-
-        species_id_url = f"https://www.inaturalist.org/observations?iconic_taxa=Aves&place_id=125852&subview=map&taxon_id={species_info['taxon_id']}"
-
-        species_map_html = generate_map_html(species, latitudes, longitudes)
-        species_anchor = species.replace(" ", "_")
-        html_content += f"""
-        <div class="species-container" id="{species_anchor}">
-            <div class="map-container">
-                <div class="map-title"><a href="{species_id_url}" target="_blank">{i}. {species}</a></div>
-                <div class="subheader">Observações em Nível de Pesquisa: {len(species_info["observations"])}</div>
-                <div style="width: 100%; height: 400px;">{species_map_html}</div>
-            </div>
-            <div class="species-info">
-                <div class="image-header">Primeira Observação</div>
-                <a href="{first_observation_url}" target="_blank">
-                    <img src="{first_img_url}" alt="{species}">
-                </a>
-                <p><a href="{first_user_profile_url}" target="_blank">{first_user_name}</a>, {first_license} ({first_observation_date})</p>
-                <div class="image-header">Observação Mais Recente</div>
-                <a href="{recent_observation_url}" target="_blank">
-                    <img src="{recent_img_url}" alt="{species}">
-                </a>
-                <p><a href="{recent_user_profile_url}" target="_blank">{recent_user_name}</a>, {recent_license} ({recent_observation_date})</p>
-            </div>
-        </div>
-        """
-
-    # Add bottom navigation links
-    html_content += '<div class="bottom-nav">'
-    if page_num > 0:
-        html_content += f'<a href="heatmaps_page_{page_num}.html">Anterior</a>'
-    if page_num < total_pages - 1:
-        html_content += f'<a href="heatmaps_page_{page_num + 2}.html">Próxima</a>'
-    html_content += "</div>"
-
-    html_content += """
-    <script>
-        function navigateToSpecies() {
-            var select = document.getElementById('species-select');
-            var page = select.value;
-            if (page) {
-                window.location.href = page;
-            }
-        }
-    </script>
-    </body>
-    </html>
-    """
+# Render the species maps in page order; with --workers they render in
+# parallel while the pages below are written
+species_maps = run_report.timed(
+    map_renderer.render_many(
+        (species.replace(" ", "_"), species_data[species]) for species in species_list
+    ),
+    "render",
+)
 
-    # Save the HTML content to a file
-    with open(f"heatmaps_page_{page_num + 1}.html", "w", encoding="utf-8") as f:
-        f.write(html_content)
+# Entries of the species dropdown shown on every page
+run_report.begin("write")
+options = species_options(species_list, species_data)
+# Pages and data files whose contents did not change are left untouched
+page_writer = PageWriter("paginated_heatmap")
+species_index_url = None
+if args.species_index:
+    species_index_url = write_species_index(options, page_writer)
+
+# Write each page
+write_paginated_pages(
+    page_writer,
+    species_list,
+    species_data,
+    species_maps,
+    options,
+    map_renderer.script_html,
+    species_index_url,
+)
 
 print("Paginated heatmaps saved.")
+map_renderer.write_data(page_writer)
+page_writer.finish()
+run_report.finish(map_renderer.render_times)
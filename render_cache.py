@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = "render_cache"
+DEFAULT_CACHE_MB = 500
+
+
+# On-disk cache of rendered HTML fragments keyed by a hash of everything the
+# fragment is rendered from. Identical inputs always render to the same bytes
+# (see map_rendering.render_map_iframe), so a hit can be reused as is. Files
+# are evicted least recently used first once the cache outgrows max_bytes;
+# their modification time records the last use, so the order survives runs.
+class RenderCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MB * 1e6):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".html"):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        self.sizes = OrderedDict(
+            (key, size) for _, key, size in sorted(entries, key=lambda entry: entry[0])
+        )
+        self.total_bytes = sum(self.sizes.values())
+        self.evict()
+
+    # Function to hash fragment inputs: arrays by their bytes, anything else
+    # by its JSON form
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(np.ascontiguousarray(part, dtype=np.float64).tobytes())
+            else:
+                digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.html")
+
+    # Function to get a cached fragment, or None
+    def get(self, key):
+        if key not in self.sizes:
+            self.misses += 1
+            return None
+        path = self.path(key)
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        os.utime(path)
+        self.sizes.move_to_end(key)
+        self.hits += 1
+        return html
+
+    # Function to store a fragment, evicting the least recently used ones
+    # while the cache is over its size bound
+    def put(self, key, html):
+        path = self.path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        self.total_bytes += size - self.sizes.pop(key, 0)
+        self.sizes[key] = size
+        self.evict()
+
+    # Function to remove the least recently used fragments while the cache is
+    # over its size bound, always keeping the newest one
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.sizes) > 1:
+            key, size = self.sizes.popitem(last=False)
+            os.remove(self.path(key))
+            self.total_bytes -= size
@@ -0,0 +1,82 @@
+// Fills the species dropdown of a paginated page from the shared species
+// index written by the generators with --species-index, instead of every page
+// repeating an <option> per species. The index is cached in localStorage under
+// its versioned URL, which changes only with the species list, so the dropdown
+// fills at once; the index is then revalidated with the server (a 304 when it
+// did not change) to pick up new observation counts. The search box filters
+// the dropdown by prefix of any word of the species name.
+(function () {
+    var script = document.currentScript;
+    var indexUrl = script.getAttribute("data-species-index");
+    var select = document.getElementById("species-select");
+    var search = document.getElementById("species-search");
+    var cacheKey = "species-index:" + indexUrl;
+    var entries = [];
+
+    function matches(entry, prefix) {
+        if (!prefix) {
+            return true;
+        }
+        return entry.name.toLowerCase().split(" ").some(function (word, i, words) {
+            return words.slice(i).join(" ").indexOf(prefix) === 0;
+        });
+    }
+
+    function fill(prefix) {
+        select.length = 1;
+        entries.forEach(function (entry) {
+            if (matches(entry, prefix)) {
+                var option = document.createElement("option");
+                option.value = "heatmaps_page_" + entry.page + ".html#" + entry.anchor;
+                option.textContent = entry.name + " (" + entry.count + ")";
+                select.appendChild(option);
+            }
+        });
+    }
+
+    function load(index) {
+        entries = index.species.map(function (row) {
+            return { name: row[0], anchor: row[1], page: row[2], count: row[3] };
+        });
+        fill(search.value.trim().toLowerCase());
+    }
+
+    search.addEventListener("input", function () {
+        fill(search.value.trim().toLowerCase());
+    });
+    search.addEventListener("keydown", function (event) {
+        // Enter jumps to the first match
+        if (event.key === "Enter" && select.length > 1) {
+            window.location.href = select.options[1].value;
+        }
+    });
+
+    var cached = null;
+    try {
+        cached = window.localStorage.getItem(cacheKey);
+    } catch (error) {
+        // Storage may be disabled; fall back to the HTTP cache
+    }
+    if (cached) {
+        load(JSON.parse(cached));
+    }
+    fetch(indexUrl, { cache: "no-cache" })
+        .then(function (response) { return response.text(); })
+        .then(function (text) {
+            if (text === cached) {
+                return;
+            }
+            try {
+                // Drop indexes cached by earlier builds before storing this one
+                Object.keys(window.localStorage).forEach(function (key) {
+                    if (key.indexOf("species-index:") === 0) {
+                        window.localStorage.removeItem(key);
+                    }
+                });
+                window.localStorage.setItem(cacheKey, text);
+            } catch (error) {
+                // Quota exceeded or storage disabled
+            }
+            load(JSON.parse(text));
+        });
+})();
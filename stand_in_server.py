@@ -0,0 +1,184 @@
+import argparse
+import hashlib
+import json
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlparse
+
+from inat_sync import read_captured_pages
+
+# Local stand-in for the iNaturalist and Wikipedia APIs, serving captured
+# observations and fixture descriptions so the generators can run without
+# network access, e.g.
+#
+#   python stand_in_server.py --observations observations.json
+#   python heatmap_generator.py --requests-per-second 0 \
+#       --inat-api http://localhost:8000/v1/observations
+#
+# and for the Wikipedia generator also
+#   --wikipedia-api http://localhost:8000/w/api.php
+#
+# Observations are served from /v1/observations with id_below/id_above
+# paging, order=asc|desc, per_page, updated_since and only_id. The other
+# search filters are ignored: the captured records are assumed to match them.
+# Wikipedia fixtures are a JSON file of {"pages": {title: intro_html},
+# "redirects": {title: target}}, served through the multi-title query API
+# (/w/api.php) and the page summary API (/api/rest_v1/page/summary/<title>).
+
+MAX_PER_PAGE = 200
+
+
+# Function to parse an ISO 8601 timestamp for updated_since comparisons
+def parse_timestamp(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    observations = []
+    wikipedia_pages = {}
+    wikipedia_redirects = {}
+    latency = 0.0
+    verbose = False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        time.sleep(self.latency)
+        if url.path == "/v1/observations":
+            self.send_json(self.observation_page(params))
+        elif url.path == "/w/api.php":
+            self.send_json(self.wikipedia_query(params))
+        elif url.path.startswith("/api/rest_v1/page/summary/"):
+            title = unquote(url.path.rsplit("/", 1)[1]).replace("_", " ")
+            title = self.wikipedia_redirects.get(title, title)
+            if title in self.wikipedia_pages:
+                self.send_json(
+                    {"title": title, "extract_html": self.wikipedia_pages[title]}
+                )
+            else:
+                self.send_json({"title": title, "type": "not_found"}, status=404)
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    # Function to answer an observation search, ordered by id
+    def observation_page(self, params):
+        results = self.observations
+        if "id_below" in params:
+            results = [o for o in results if o["id"] < int(params["id_below"])]
+        if "id_above" in params:
+            results = [o for o in results if o["id"] > int(params["id_above"])]
+        if "updated_since" in params:
+            since = parse_timestamp(params["updated_since"])
+            results = [
+                o
+                for o in results
+                if parse_timestamp(o.get("updated_at") or o["created_at"]) >= since
+            ]
+        if params.get("order") == "asc":
+            results = results[::-1]
+        per_page = min(int(params.get("per_page", 30)), MAX_PER_PAGE)
+        page = results[:per_page]
+        if params.get("only_id") == "true":
+            page = [{"id": o["id"]} for o in page]
+        return {
+            "total_results": len(results),
+            "page": 1,
+            "per_page": per_page,
+            "results": page,
+        }
+
+    # Function to answer a MediaWiki action=query request for intros and
+    # revision ids, resolving normalisations and redirects like the real API
+    def wikipedia_query(self, params):
+        normalized = []
+        redirects = []
+        pages = {}
+        for title in params.get("titles", "").split("|"):
+            if "_" in title:
+                normalized.append({"from": title, "to": title.replace("_", " ")})
+                title = title.replace("_", " ")
+            if params.get("redirects") and title in self.wikipedia_redirects:
+                redirects.append({"from": title, "to": self.wikipedia_redirects[title]})
+                title = self.wikipedia_redirects[title]
+            if title not in self.wikipedia_pages:
+                pages[title] = {"ns": 0, "title": title, "missing": True}
+                continue
+            extract = self.wikipedia_pages[title]
+            page = {
+                "ns": 0,
+                "title": title,
+                "lastrevid": int(hashlib.sha256(extract.encode()).hexdigest()[:8], 16),
+            }
+            if "extracts" in params.get("prop", ""):
+                page["extract"] = extract
+            pages[title] = page
+        return {
+            "batchcomplete": True,
+            "query": {
+                "normalized": normalized,
+                "redirects": redirects,
+                "pages": list(pages.values()),
+            },
+        }
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve captured observations and Wikipedia fixtures locally."
+    )
+    parser.add_argument(
+        "--observations",
+        default="observations.json",
+        help=(
+            "JSON file with a list of observations or a page of results, or a "
+            "directory of such files (default: observations.json)"
+        ),
+    )
+    parser.add_argument(
+        "--wikipedia-fixtures", help="JSON file with Wikipedia intros and redirects"
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="seconds to wait before every response, to mimic a remote API",
+    )
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    observations = {}
+    for page in read_captured_pages(args.observations):
+        for observation in page:
+            observations[observation["id"]] = observation
+    StandInHandler.observations = sorted(
+        observations.values(), key=lambda o: o["id"], reverse=True
+    )
+    if args.wikipedia_fixtures:
+        with open(args.wikipedia_fixtures, encoding="utf-8") as f:
+            fixtures = json.load(f)
+        StandInHandler.wikipedia_pages = fixtures.get("pages", {})
+        StandInHandler.wikipedia_redirects = fixtures.get("redirects", {})
+    StandInHandler.latency = args.latency
+    StandInHandler.verbose = args.verbose
+
+    server = ThreadingHTTPServer(("localhost", args.port), StandInHandler)
+    print(
+        f"Serving {len(observations)} observations and "
+        f"{len(StandInHandler.wikipedia_pages)} Wikipedia pages "
+        f"on http://localhost:{args.port}"
+    )
+    server.serve_forever()
@@ -0,0 +1,219 @@
+import os
+import re
+import sys
+from collections.abc import Mapping
+
+import numpy as np
+
+from aggregation import coordinate_summary, parse_observed_dates
+from observation_records import ObservationRecord
+
+DEFAULT_SPILL_DIR = "species_partitions"
+# Empty file tagging a directory as one written by PartitionedSpeciesData
+SPILL_MARKER = ".species_partitions"
+PARTITION_NAME = re.compile(r"\d{6}\.bin")
+# Slimmed record spilled to a species partition: everything the maps need,
+# plus the id and date that fix the order aggregate_species gives them
+SPILL_DTYPE = np.dtype(
+    [
+        ("id", "<i8"),
+        ("date", "<i8"),
+        ("latitude", "<f8"),
+        ("longitude", "<f8"),
+        ("accuracy", "<f8"),
+    ]
+)
+# Unknown dates are stored as the largest day so they sort last, like NaT
+UNKNOWN_DATE = np.iinfo(np.int64).max
+
+
+# Per-species summary whose point columns and centre are read from the
+# species partition only when they are first looked up, i.e. when the map is
+# rendered; the page fields come from the running aggregates
+class PartitionSummary(dict):
+    def __init__(self, path, aggregates):
+        super().__init__(aggregates)
+        self.path = path
+
+    def __missing__(self, key):
+        if key not in ("latitudes", "longitudes", "accuracies", "center"):
+            raise KeyError(key)
+        records = np.fromfile(self.path, dtype=SPILL_DTYPE)
+        records = records[np.lexsort((-records["id"], records["date"]))]
+        latitudes = records["latitude"]
+        longitudes = records["longitude"]
+        self["latitudes"] = latitudes
+        self["longitudes"] = longitudes
+        self["accuracies"] = records["accuracy"]
+        self["center"] = [
+            float(np.add.reduceat(latitudes, [0])[0] / len(records)),
+            float(np.add.reduceat(longitudes, [0])[0] / len(records)),
+        ]
+        return self[key]
+
+
+# Function to empty a spill directory for a new build. Only directories
+# this module created, tagged with SPILL_MARKER, are emptied, and only of
+# their partition files; any other non-empty directory is refused, so a
+# mistyped --spill-dir cannot delete unrelated files.
+def prepare_spill_dir(directory):
+    os.makedirs(directory, exist_ok=True)
+    names = os.listdir(directory)
+    if names and SPILL_MARKER not in names:
+        sys.exit(
+            f"Refusing to spill into {directory}: it is not empty and was not "
+            "created by a streaming build"
+        )
+    for name in names:
+        if PARTITION_NAME.fullmatch(name):
+            os.remove(os.path.join(directory, name))
+    open(os.path.join(directory, SPILL_MARKER), "w").close()
+
+
+# Function to compare records the way aggregate_species orders them: by date
+# with unknown dates last, then newest id first
+def order_key(record, date):
+    return (date, -record.id)
+
+
+# Species data built by streaming observation pages to disk. Each accepted
+# record is slimmed to SPILL_DTYPE and appended to its species' partition
+# file as the pages arrive, and only running aggregates (count, bounding box,
+# first and latest observation) stay in memory. Looking a species up gives
+# the same summary aggregate_species would, with the points loaded lazily.
+# Sources must not repeat ids, which holds for full walks of the feed.
+class PartitionedSpeciesData(Mapping):
+    def __init__(self, directory=DEFAULT_SPILL_DIR):
+        self.directory = directory
+        prepare_spill_dir(directory)
+        self.aggregates = {}
+        self.paths = {}
+        self.records = 0
+        # Running coordinate sums, for the centre of the complete heatmap
+        self.latitude_sum = 0.0
+        self.longitude_sum = 0.0
+
+    # Function to spill one page of raw API observations
+    def add_page(self, observations):
+        groups = {}
+        for observation in observations:
+            record = ObservationRecord.from_api(observation)
+            if record is not None:
+                groups.setdefault(record.taxon_name, []).append(record)
+        for species, records in groups.items():
+            dates = parse_observed_dates(records)
+            days = dates.astype(np.int64)
+            days[np.isnat(dates)] = UNKNOWN_DATE
+            spill = np.empty(len(records), dtype=SPILL_DTYPE)
+            spill["id"] = [record.id for record in records]
+            spill["date"] = days
+            spill["latitude"] = [record.latitude for record in records]
+            spill["longitude"] = [record.longitude for record in records]
+            spill["accuracy"] = [
+                (
+                    record.positional_accuracy
+                    if record.positional_accuracy is not None
+                    else np.nan
+                )
+                for record in records
+            ]
+            if species not in self.paths:
+                self.paths[species] = os.path.join(
+                    self.directory, f"{len(self.paths):06d}.bin"
+                )
+            with open(self.paths[species], "ab") as f:
+                spill.tofile(f)
+            self.update_aggregates(species, records, spill)
+            self.records += len(records)
+            self.latitude_sum += float(spill["latitude"].sum())
+            self.longitude_sum += float(spill["longitude"].sum())
+
+    # Function to fold a page's records of one species into its aggregates
+    def update_aggregates(self, species, records, spill):
+        aggregates = self.aggregates.get(species)
+        if aggregates is None:
+            aggregates = self.aggregates[species] = {
+                "count": 0,
+                "bounds": [[np.inf, np.inf], [-np.inf, -np.inf]],
+                "first_observation": None,
+                "recent_observation": None,
+                "taxon_id": records[0].taxon_id,
+                "first_key": None,
+                "recent_key": None,
+            }
+        aggregates["count"] += len(records)
+        bounds = aggregates["bounds"]
+        bounds[0][0] = min(bounds[0][0], float(spill["latitude"].min()))
+        bounds[0][1] = min(bounds[0][1], float(spill["longitude"].min()))
+        bounds[1][0] = max(bounds[1][0], float(spill["latitude"].max()))
+        bounds[1][1] = max(bounds[1][1], float(spill["longitude"].max()))
+        for record, date in zip(records, spill["date"].tolist()):
+            key = order_key(record, date)
+            if aggregates["first_key"] is None or key < aggregates["first_key"]:
+                aggregates["first_key"] = key
+                aggregates["first_observation"] = record
+                aggregates["taxon_id"] = record.taxon_id
+            if aggregates["recent_key"] is None or key > aggregates["recent_key"]:
+                aggregates["recent_key"] = key
+                aggregates["recent_observation"] = record
+
+    def __getitem__(self, species):
+        aggregates = self.aggregates[species]
+        return PartitionSummary(
+            self.paths[species],
+            {
+                key: value
+                for key, value in aggregates.items()
+                if key not in ("first_key", "recent_key")
+            },
+        )
+
+    # Species in alphabetical order, like aggregate_species
+    def __iter__(self):
+        return iter(sorted(self.aggregates))
+
+    def __len__(self):
+        return len(self.aggregates)
+
+    # Function to summarise every observation, for the complete heatmap. The
+    # heat points are gathered one partition at a time by the map renderer
+    # (see MapRenderer.combined_heat_points), so with a binning grid only the
+    # cells of the complete map are held in memory, not its points.
+    def overall_summary(self, map_renderer):
+        if not self.records:
+            empty = np.empty(0, dtype=np.float64)
+            return coordinate_summary(empty, empty, empty)
+        bounds = [aggregates["bounds"] for aggregates in self.aggregates.values()]
+        center = [
+            self.latitude_sum / self.records,
+            self.longitude_sum / self.records,
+        ]
+        return {
+            "count": self.records,
+            "center": center,
+            "bounds": [
+                [
+                    min(bound[0][0] for bound in bounds),
+                    min(bound[0][1] for bound in bounds),
+                ],
+                [
+                    max(bound[1][0] for bound in bounds),
+                    max(bound[1][1] for bound in bounds),
+                ],
+            ],
+            "heat_points": map_renderer.combined_heat_points(
+                (self[species] for species in self), center[0]
+            ),
+        }
+
+
+# Function to stream pages of raw API observations into species partitions
+def stream_species(pages, directory=DEFAULT_SPILL_DIR):
+    species_data = PartitionedSpeciesData(directory)
+    for observations in pages:
+        species_data.add_page(observations)
+    print(
+        f"Streamed {species_data.records} observations of {len(species_data)} "
+        f"species into {directory}"
+    )
+    return species_data
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+
+from observation_records import ObservationRecord
+
+# Bumped whenever the checkpoint layout changes; older checkpoints are dropped
+CHECKPOINT_VERSION = 1
+STATE_NAME = "state.json"
+
+
+# Function to write a file so that it is either fully replaced or untouched,
+# even if the process or the machine stops halfway
+def write_atomically(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# Progress of a sync that has not been saved to the store yet. The sync is a
+# list of stages run one after the other, each a list of walks of the feed
+# run concurrently; every walk records the cursor of its last accepted page.
+# Accepting a page first writes its records to page_NNNNNN.json, then the
+# state with the page count and cursors, so after a crash the state names
+# only pages that are on disk and the walks resume right after them.
+class SyncCheckpoint:
+    def __init__(self, directory):
+        self.directory = directory
+        self.state = None
+
+    # Function to load the checkpoint of an interrupted sync, returning
+    # whether there was one to resume
+    def load(self):
+        path = os.path.join(self.directory, STATE_NAME)
+        if not os.path.isfile(path):
+            return False
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") != CHECKPOINT_VERSION:
+            return False
+        self.state = state
+        return True
+
+    # Function to start checkpointing a new sync, dropping any previous one
+    def start(self, mode, started_at, stages):
+        self.clear()
+        os.makedirs(self.directory)
+        self.state = {
+            "version": CHECKPOINT_VERSION,
+            "mode": mode,
+            "started_at": started_at,
+            "stages": stages,
+            "stage": 0,
+            "pages": 0,
+        }
+        self.save_state()
+
+    def save_state(self):
+        write_atomically(os.path.join(self.directory, STATE_NAME), self.state)
+
+    def page_path(self, number):
+        return os.path.join(self.directory, f"page_{number:06d}.json")
+
+    # Function to yield the accepted pages as (id, updated_at, record) entries
+    def saved_pages(self):
+        for number in range(1, self.state["pages"] + 1):
+            with open(self.page_path(number), encoding="utf-8") as f:
+                yield [
+                    (
+                        observation_id,
+                        updated_at,
+                        ObservationRecord.from_list(values) if values else None,
+                    )
+                    for observation_id, updated_at, values in json.load(f)
+                ]
+
+    # Function to save an accepted page, after its walk's cursor was moved
+    def accept(self, entries):
+        number = self.state["pages"] + 1
+        write_atomically(
+            self.page_path(number),
+            [
+                [observation_id, updated_at, record.to_list() if record else None]
+                for observation_id, updated_at, record in entries
+            ],
+        )
+        self.state["pages"] = number
+        self.save_state()
+
+    # Function to record that every walk of the current stage is complete
+    def finish_stage(self):
+        self.state["stage"] += 1
+        self.save_state()
+
+    def clear(self):
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
@@ -0,0 +1,246 @@
+import json
+import os
+import re
+import time
+
+import requests
+from tqdm import tqdm
+
+from http_client import WIKIPEDIA_CLIENT
+
+WIKIPEDIA_API_URL = "https://pt.wikipedia.org/w/api.php"
+# Titles per query: revision lookups accept 50, intro extracts at most 20
+INFO_BATCH_SIZE = 50
+EXTRACT_BATCH_SIZE = 20
+NO_DESCRIPTION = "Descrição não disponível."
+DEFAULT_CACHE_PATH = "wikipedia_cache.json"
+DEFAULT_TTL_DAYS = 30
+# Bumped whenever the cached entry layout changes; older caches are dropped
+CACHE_VERSION = 2
+FIRST_PARAGRAPH = re.compile(r"<p>(?!\s*</p>).*?</p>", re.DOTALL)
+
+
+class WikipediaError(Exception):
+    pass
+
+
+# Function to register the Wikipedia description options
+def add_wikipedia_arguments(parser):
+    parser.add_argument(
+        "--wikipedia-cache",
+        default=DEFAULT_CACHE_PATH,
+        help=f"local cache of Wikipedia summaries (default: {DEFAULT_CACHE_PATH})",
+    )
+    parser.add_argument(
+        "--wikipedia-ttl-days",
+        type=float,
+        default=DEFAULT_TTL_DAYS,
+        help=(
+            "revalidate cached summaries older than this many days "
+            f"(default: {DEFAULT_TTL_DAYS})"
+        ),
+    )
+    parser.add_argument(
+        "--wikipedia-api",
+        default=WIKIPEDIA_API_URL,
+        help=f"MediaWiki API to query (default: {WIKIPEDIA_API_URL})",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="never contact Wikipedia; use cached summaries only",
+    )
+    parser.add_argument(
+        "--evict-wikipedia",
+        action="append",
+        default=[],
+        metavar="SPECIES",
+        help="drop the cached summary of a species ('all' clears the cache)",
+    )
+
+
+# Function to load the summary cache: a dict of entries keyed by species,
+# each with the intro (None for a missing page), the page revision it came
+# from and when it was last fetched or revalidated
+def load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != CACHE_VERSION:
+        print(f"Ignoring {path}: written by an older version")
+        return {}
+    return data["entries"]
+
+
+# Function to save the cache atomically so an interrupted run keeps the old one
+def save_cache(cache, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"version": CACHE_VERSION, "entries": cache},
+            f,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+    os.replace(tmp_path, path)
+
+
+# Function to remove cached summaries; "all" empties the cache
+def evict_entries(cache, species_names):
+    for species in species_names:
+        if species == "all":
+            cache.clear()
+        else:
+            cache.pop(species.replace("_", " "), None)
+
+
+# Function to split a list into batches of at most size items
+def batches(items, size):
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+# Function to keep the first paragraph of an intro, like the page summaries
+# the descriptions used to come from
+def first_paragraph(extract):
+    match = FIRST_PARAGRAPH.search(extract or "")
+    return match.group(0) if match else extract
+
+
+# Function to run one multi-title query, following continuations, and map
+# every requested title to its page (None when the page does not exist).
+# Titles are resolved through the normalisations and redirects the API
+# reports, so a species whose page was renamed still gets its description.
+def query_titles(api_url, titles, prop):
+    params = {
+        "action": "query",
+        "format": "json",
+        "formatversion": "2",
+        "prop": prop,
+        "titles": "|".join(titles),
+        "redirects": "1",
+    }
+    if "extracts" in prop:
+        params.update({"exintro": "1", "exlimit": "max"})
+    pages = {}
+    renamed = {}
+    continuation = {}
+    while True:
+        response = WIKIPEDIA_CLIENT.get(api_url, params={**params, **continuation})
+        if response.status_code != 200:
+            raise WikipediaError(f"status code {response.status_code}")
+        data = response.json()
+        query = data.get("query", {})
+        for rename in query.get("normalized", []) + query.get("redirects", []):
+            renamed[rename["from"]] = rename["to"]
+        for page in query.get("pages", []):
+            pages.setdefault(page["title"], {}).update(page)
+        if "continue" not in data:
+            break
+        continuation = data["continue"]
+
+    resolved = {}
+    for title in titles:
+        target = title
+        # A title can be normalised and then redirected; stop on any loop
+        for _ in range(len(renamed) + 1):
+            if target not in renamed:
+                break
+            target = renamed[target]
+        page = pages.get(target)
+        if page is None or page.get("missing") or page.get("invalid"):
+            resolved[title] = None
+        else:
+            resolved[title] = page
+    return resolved
+
+
+# Function to refresh the cache entries of the given species. Entries that
+# are already cached are first revalidated with a cheap revision lookup
+# (INFO_BATCH_SIZE titles per request); only new species and pages edited
+# since they were cached have their intro fetched, EXTRACT_BATCH_SIZE at a
+# time. Returns the species whose page does not exist.
+def refresh_entries(cache, species_names, api_url):
+    now = time.time()
+    to_fetch = [species for species in species_names if species not in cache]
+    cached = [species for species in species_names if species in cache]
+    missing = []
+    batches_made = 0
+
+    for batch in tqdm(
+        batches(cached, INFO_BATCH_SIZE), desc="Revalidating Wikipedia descriptions"
+    ):
+        try:
+            pages = query_titles(api_url, batch, "info")
+        except (requests.RequestException, WikipediaError) as e:
+            print(f"Error revalidating Wikipedia descriptions: {e}")
+            continue
+        batches_made += 1
+        for species, page in pages.items():
+            revision = page["lastrevid"] if page else None
+            if revision == cache[species]["revision"]:
+                cache[species]["fetched_at"] = now
+            else:
+                to_fetch.append(species)
+
+    for batch in tqdm(
+        batches(to_fetch, EXTRACT_BATCH_SIZE), desc="Fetching Wikipedia descriptions"
+    ):
+        try:
+            pages = query_titles(api_url, batch, "extracts|info")
+        except (requests.RequestException, WikipediaError) as e:
+            print(f"Error fetching Wikipedia descriptions: {e}")
+            continue
+        batches_made += 1
+        for species, page in pages.items():
+            if page is None:
+                missing.append(species)
+            cache[species] = {
+                "extract_html": first_paragraph(page.get("extract")) if page else None,
+                "revision": page["lastrevid"] if page else None,
+                "fetched_at": now,
+            }
+    return missing, batches_made
+
+
+# Function to get the description of every species, going to Wikipedia only
+# for species that are not cached yet or whose entry is older than the TTL.
+# Offline, cached entries are used however old they are.
+def fetch_wikipedia_descriptions(
+    species_list,
+    cache_path=DEFAULT_CACHE_PATH,
+    ttl_days=DEFAULT_TTL_DAYS,
+    offline=False,
+    evict=(),
+    api_url=WIKIPEDIA_API_URL,
+):
+    cache = load_cache(cache_path)
+    evict_entries(cache, evict)
+    now = time.time()
+    stale = []
+    if not offline:
+        stale = [
+            species
+            for species in species_list
+            if species not in cache
+            or now - cache[species]["fetched_at"] > ttl_days * 24 * 3600
+        ]
+    missing, batches_made = refresh_entries(cache, stale, api_url)
+    WIKIPEDIA_CLIENT.print_metrics()
+    if missing:
+        print(f"No Wikipedia page for {len(missing)} species: {', '.join(missing)}")
+
+    if not offline:
+        save_cache(cache, cache_path)
+    print(
+        f"Wikipedia descriptions: {len(species_list) - len(stale)} cached, "
+        f"{len(stale)} refreshed in {batches_made} batches"
+    )
+
+    species_descriptions = {}
+    for species in species_list:
+        extract = cache.get(species, {}).get("extract_html")
+        species_descriptions[species] = (
+            extract if extract is not None else NO_DESCRIPTION
+        )
+    return species_descriptions